@@ -1,21 +1,25 @@
 import logging
 import os
-import re
+import time
 from datetime import datetime
+from functools import partial
 from logging.handlers import TimedRotatingFileHandler
 
-from flask import Flask, flash, g, redirect, render_template, request, session, url_for
-from flask_mail import Mail, Message
+from flask import Flask, abort, flash, g, redirect, render_template, request, session, url_for
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
-from markupsafe import Markup, escape
+from markupsafe import Markup
 from mastodon import MastodonIllegalArgumentError, MastodonUnauthorizedError
 from pymysql import InternalError
 from sqlalchemy import exc
 
+from tr import feed_cache, http_client, mail_outbox, mastodon_clients, metadata_cache, metrics
+from tr.db import HealthCheck, PooledSQLAlchemy
 from tr.forms import MastodonIDForm, SubmissionForm
 from tr.helpers import get_or_create_host, mastodon_api
-from tr.models import Post, Settings, User, metadata
+from tr.models import Post, Settings, User, metadata, nl2br
+from tr.pagination import NEWER, OLDER, CursorCodec, keyset_page
+from tr.previews import PreviewCodec
+from tr.queries import feed_items, feed_posts, queue_stats
 
 app = Flask(__name__)
 
@@ -34,44 +38,134 @@ app.logger.info("Starting up...")
 
 config = os.environ.get('TR_CONFIG', 'config.DevelopmentConfig')
 app.config.from_object(config)
-mail = Mail(app)
+http_client.configure(app.config)
+mastodon_clients.configure(app.config)
 
 if app.config['SENTRY_DSN']:
     from raven.contrib.flask import Sentry
 
     sentry = Sentry(app, dsn=app.config['SENTRY_DSN'])
 
-db = SQLAlchemy(metadata=metadata)
+db = PooledSQLAlchemy(metadata=metadata)
 migrate = Migrate(app, db)
 
 db.init_app(app)
 
+cursor_codec = CursorCodec(app.config['SECRET_KEY'])
+preview_codec = PreviewCodec(app.config['SECRET_KEY'], max_age=app.config.get('PREVIEW_MAX_AGE', 3600))
+feed_cache.configure(app.config)
+
+with app.app_context():
+    metadata_cache.configure(app.config, db.engine)
+    metrics.instrument_engine(db.engine)
+
+health_check = HealthCheck(lambda: db.engine, app.config.get('DB_HEALTH_INTERVAL', 30))
+
 
 @app.before_request
 def before_request():
+    g.request_start = time.perf_counter()
+    app.logger.debug(session)
 
-    try:
-        db.engine.execute('SELECT 1 from users')
-    except exc.SQLAlchemyError as e:
-        return f"Song Delivery is unavailable at the moment: {e}", 503
 
-    app.logger.debug(session)
+@app.after_request
+def after_request(response):
+    if 'request_start' in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                                        route=request.url_rule.rule if request.url_rule else 'unmatched',
+                                        method=request.method,
+                                        status=response.status_code)
+
+    return response
+
+
+@app.errorhandler(exc.OperationalError)
+@app.errorhandler(exc.TimeoutError)
+def database_unavailable(e):
+    app.logger.error(e)
+    db.session.rollback()
+    health_check.check(force=True)
+
+    return f"Song Delivery is unavailable at the moment: {e}", 503
+
+
+@app.route('/health')
+def health():
+    if health_check.check():
+        return "OK"
+
+    return f"Database unavailable: {health_check.error}", 503
+
+
+@app.route('/metrics')
+def metrics_text():
+    """ Prometheus metrics for this process, plus queue depths read from the database """
+
+    if not app.config.get('METRICS_ENABLED', False):
+        abort(404)
+
+    now = datetime.utcnow()
+    queues = queue_stats(db.session,
+                         app.config.get('REBLOG_MAX_ATTEMPTS', 10),
+                         app.config.get('MAIL_MAX_ATTEMPTS', 8))
+
+    for queue, (depth, oldest) in queues.items():
+        metrics.QUEUE_DEPTH.set(depth, queue=queue)
+        metrics.QUEUE_OLDEST_SECONDS.set(max((now - oldest).total_seconds(), 0) if oldest else 0, queue=queue)
+
+    return metrics.REGISTRY.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
 
 
 @app.route('/', methods=["GET", "POST"])
 def index():
 
-    posts = db.session.query(Post).order_by(Post.updated.desc()).filter_by(posted=True)
+    if request.args.get('newer'):
+        cursor, direction = request.args.get('newer'), NEWER
+    else:
+        cursor, direction = request.args.get('older'), OLDER
 
-    for p in posts:
-        p.fetch_metadata()
-        db.session.commit()
+    uid = session.get('user_id', None)
 
-    return render_template('community.html.j2',
+    # the layout shows the signed-in account and any flashed messages, so
+    # only pages seen by anonymous visitors with nothing pending are shared
+    anonymous = not uid and not session.get('mastodon') and not session.get('_flashes')
+    page_key = (direction, cursor)
+
+    if anonymous:
+        html = feed_cache.cache.get_page(page_key)
+
+        if html is not None:
+            return html
+
+    page = keyset_page(feed_posts(db.session),
+                       Post.updated,
+                       Post.id,
+                       cursor_codec,
+                       app.config.get('FEED_PAGE_SIZE', 20),
+                       cursor=cursor,
+                       direction=direction)
+
+    if cursor and not page.items:
+        return redirect(url_for('index'))
+
+    cards = [feed_cache.cache.card(p, p.user_id == uid, partial(render_card, p, p.user_id == uid))
+             for p in feed_items(page.items)]
+
+    html = render_template('community.html.j2',
                            app=app,
-                           posts=posts
+                           cards=cards,
+                           page=page
                            )
 
+    if anonymous:
+        feed_cache.cache.set_page(page_key, html)
+
+    return html
+
+
+def render_card(post, owner):
+    return Markup(render_template('card.html.j2', post=post, owner=owner))
+
 
 @app.route('/post', methods=["GET", "POST"])
 def post():
@@ -90,6 +184,7 @@ def post():
             if request.form["task"] == 'Preview':
                 post.fetch_metadata()
                 sform.share_link.data = post.share_link
+                sform.preview_token.data = preview_codec.encode(post) if post.title or post.album_art else ''
                 is_preview = True
 
                 if sform.comment.data == "":
@@ -112,7 +207,14 @@ def post():
                     return redirect(url_for('logout'))
 
                 post.user_id = user.id
-                post.fetch_metadata()
+                previewed = preview_codec.decode(sform.preview_token.data, post.share_link)
+
+                if previewed:
+                    post.title, post.album_art = previewed
+                else:
+                    # no usable preview; the metadata worker looks the link up
+                    post.metadata_queued = True
+
                 db.session.add(post)
                 try:
                     db.session.commit()
@@ -276,15 +378,12 @@ def mastodon_oauthorized():
 
                 body = render_template('email/new_user_email.txt.j2',
                                        user=user)
-                msg = Message(subject=f"New {app.config.get('SITE_NAME', None)} user",
-                              body=body,
-                              recipients=[app.config.get('MAIL_TO', None)])
-
-                try:
-                    mail.send(msg)
-
-                except Exception as e:
-                    app.logger.error(e)
+                mail_outbox.enqueue(db.session,
+                                    mail_outbox.NEW_USER,
+                                    f"New {app.config.get('SITE_NAME', None)} user",
+                                    body,
+                                    app.config.get('MAIL_TO', None))
+                db.session.commit()
 
     return redirect(url_for('index'))
 
@@ -309,6 +408,7 @@ def delete_post(post_id):
 
         db.session.delete(post_to_delete)
         db.session.commit()
+        feed_cache.cache.invalidate()
 
         flash("Deleted")
     return redirect(url_for('index'))
@@ -327,13 +427,7 @@ def privacy():
                            app=app)
 
 
-@app.template_filter('nl2br')
-def nl2br(value):
-    _paragraph_re = re.compile(r'(?:\r\n|\r|\n){2,}')
-
-    result = u'\n\n'.join(u'<p>%s</p>' % p.replace('\n', Markup('<br>\n'))
-                          for p in _paragraph_re.split(escape(value)))
-    return result
+app.add_template_filter(nl2br, 'nl2br')
 
 
 if __name__ == '__main__':
@@ -6,6 +6,12 @@ class DefaultConfig(object):
     CSRF_ENABLED = True
     SECRET_KEY = 'this-really-needs-to-be-changed'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_TIMEOUT = 10
+    DB_CONNECT_TIMEOUT = 10
+    DB_HEALTH_INTERVAL = 30
     SQLALCHEMY_DATABASE_URI = 'sqlite:///tr.db'
     # SQLALCHEMY_DATABASE_URI = 'mysql+pymysql://tr:tr@localhost/tr'
     SEND = True
@@ -18,7 +24,53 @@ class DefaultConfig(object):
     MAIL_PASSWORD = ''
     MAIL_TO = ''
     MAIL_DEFAULT_SENDER = ''
+    MAIL_BATCH = 100
+    MAIL_MAX_ATTEMPTS = 8
+    MAIL_RETRY_TIME = 60
+    MAIL_DIGEST = False
+    MAIL_DIGEST_INTERVAL = 3600
     WORKER_JOBS = 1
+    WORKER_HOST_CONCURRENCY = 2
+    WORKER_CLAIM_BATCH = 100
+    WORKER_QUEUE_BATCH = 25
+    WORKER_LEASE_TIME = 600
+    WORKER_POLL_MIN = 2
+    WORKER_POLL_MAX = 60
+    POST_MAX_ATTEMPTS = 10
+    POST_RETRY_TIME = 60
+    REBLOG_BATCH = 50
+    REBLOG_MAX_ATTEMPTS = 10
+    REBLOG_RETRY_TIME = 30
+    FEED_PAGE_SIZE = 20
+    FEED_CACHE_STAMP = 'tmp/feed.stamp'
+    FEED_CACHE_SIZE = 256
+    FEED_CACHE_TTL = 3600
+    PREVIEW_MAX_AGE = 3600
+    HTTP_POOL_CONNECTIONS = 10
+    HTTP_POOL_MAXSIZE = 10
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 15
+    HTTP_MAX_BYTES = 10 * 1024 * 1024
+    HTTP_RETRIES = 2
+    MASTODON_CLIENT_CACHE_SIZE = 256
+    MASTODON_REQUEST_TIMEOUT = 10
+    HOST_BACKOFF_MIN = 30
+    HOST_BACKOFF_MAX = 3600
+    HOST_RATELIMIT_WINDOW = 300
+    HOST_RATELIMIT_RESERVE = 5
+    HOST_MAX_WAIT = 10
+    METADATA_CACHE_SIZE = 1024
+    METADATA_CACHE_TTL = 7 * 24 * 3600
+    METADATA_CACHE_DB = True
+    ARTWORK_DIR = 'tmp/artwork'
+    ARTWORK_STORE_BYTES = 256 * 1024 * 1024
+    ARTWORK_MAX_BYTES = 8 * 1024 * 1024
+    ARTWORK_MAX_DIMENSION = 1024
+    ARTWORK_QUALITY = 85
+    ARTWORK_FORMAT = 'JPEG'
+    METRICS_ENABLED = False
+    METRICS_TEXTFILE = 'tmp/worker.prom'
+    METRICS_METADATA_TEXTFILE = 'tmp/metadata_worker.prom'
     MAINTENANCE_MODE = False
     DEVELOPMENT = False
     ACCOUNT_ACCESS_TOKEN = None
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Measure what artwork normalization saves: bytes per image and the time
+from having the original on disk to the upload finishing, uploading
+either the original or the normalized copy.
+
+Uploads go as multipart POSTs (like Mastodon.py's media_post) to a local
+server that throttles its reads to --mbps, standing in for the uplink to
+an instance. Fixture images are generated, sized like the originals
+song.link and Bandcamp hand out; pass your own files to measure those.
+
+    pipenv run python tools/bench_artwork.py [--mbps 20] [image ...]
+"""
+import argparse
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import requests  # noqa: E402
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from tr import imaging  # noqa: E402
+
+FIXTURES = [
+    ('bandcamp_original.jpg', 3000, 'JPEG'),
+    ('songlink_large.jpg', 1500, 'JPEG'),
+    ('cover_png.png', 1400, 'PNG'),
+    ('small_thumb.jpg', 600, 'JPEG'),
+]
+
+
+def make_fixture(path, size, image_format):
+    """ A gradient with some shapes and grain, so it compresses like a photo rather than a flat fill """
+
+    im = Image.radial_gradient('L').resize((size, size)).convert('RGB')
+    draw = ImageDraw.Draw(im)
+
+    for i in range(12):
+        x = (i * 97) % size
+        draw.ellipse([x, x // 2, x + size // 4, x // 2 + size // 4], fill=(i * 20, 255 - i * 20, 128))
+
+    noise = Image.effect_noise((size, size), 40).convert('RGB')
+    im = Image.blend(im, noise, 0.25).filter(ImageFilter.SMOOTH)
+
+    options = {'quality': 95} if image_format == 'JPEG' else {}
+    im.save(path, image_format, **options)
+
+
+class ThrottledUpload(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    bytes_per_second = 20 * 1000 * 1000 / 8
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        start = time.perf_counter()
+        read = 0
+
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 64 * 1024))
+            remaining -= len(chunk)
+            read += len(chunk)
+
+            ahead = read / self.bytes_per_second - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+        body = b'{"id": 1}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class QuietServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def upload(session, url, path):
+    with open(path, 'rb') as f:
+        session.post(url, files={'file': (os.path.basename(path), f)}).raise_for_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Artwork normalization benchmark')
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--mbps', type=float, default=20, help='simulated upload bandwidth')
+    parser.add_argument('--max-dimension', type=int, default=1024)
+    parser.add_argument('--quality', type=int, default=85)
+    parser.add_argument('--format', default='JPEG', choices=sorted(imaging.EXTENSIONS))
+    args = parser.parse_args()
+
+    tmp = Path(tempfile.mkdtemp())
+    images = [Path(p) for p in args.images]
+
+    if not images:
+        for name, size, image_format in FIXTURES:
+            make_fixture(tmp / name, size, image_format)
+            images.append(tmp / name)
+
+    ThrottledUpload.bytes_per_second = args.mbps * 1000 * 1000 / 8
+    server = QuietServer(('127.0.0.1', 0), ThrottledUpload)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/api/v1/media'
+    session = requests.Session()
+
+    print(f"{args.mbps:g} Mbit/s uplink, max {args.max_dimension}px, {args.format} q{args.quality}\n")
+    print(f"{'image':24} {'original':>10} {'normalized':>10} {'saved':>6}   "
+          f"{'upload as is':>12} {'normalize+upload':>16}")
+
+    total_before = total_after = 0
+    time_before = time_after = 0
+
+    for path in images:
+        dest = tmp / (path.stem + '-normalized' + imaging.EXTENSIONS[args.format])
+
+        start = time.perf_counter()
+        upload(session, url, path)
+        original_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        imaging.normalize(str(path), str(dest), args.max_dimension, args.quality, args.format)
+        upload(session, url, dest)
+        normalized_time = time.perf_counter() - start
+
+        before, after = path.stat().st_size, dest.stat().st_size
+        total_before += before
+        total_after += after
+        time_before += original_time
+        time_after += normalized_time
+
+        print(f"{path.name[:24]:24} {before / 1024:9.0f}K {after / 1024:9.0f}K {1 - after / before:6.0%}   "
+              f"{original_time * 1000:10.0f}ms {normalized_time * 1000:14.0f}ms")
+
+    print(f"{'total':24} {total_before / 1024:9.0f}K {total_after / 1024:9.0f}K "
+          f"{1 - total_after / total_before:6.0%}   {time_before * 1000:10.0f}ms {time_after * 1000:14.0f}ms")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
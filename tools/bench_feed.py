@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Time rendering a feed page of 50, 500 and 5000 cards two ways:
+
+    orm         full Post rows with their user and host joined in, the
+                comment, links and dates worked out per card as the feed
+                used to
+    read model  feed_posts()/feed_items(): only the card's columns, with
+                the display fields the worker stored when it sent the post
+
+Card and page caches are bypassed so every round does the full work. Runs
+against a throwaway SQLite database:
+
+    pipenv run python tools/bench_feed.py [--sizes 50,500,5000] [--rounds 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(str(ROOT))
+
+from defaults import DefaultConfig  # noqa: E402
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'feed.db')
+
+
+class BenchConfig(DefaultConfig):
+    SQLALCHEMY_DATABASE_URI = f'sqlite:///{DB_PATH}'
+    FEED_CACHE_STAMP = os.path.join(tempfile.mkdtemp(), 'feed.stamp')
+    METADATA_CACHE_DB = False
+
+
+bench_config = types.ModuleType('bench_config')
+bench_config.BenchConfig = BenchConfig
+sys.modules['bench_config'] = bench_config
+os.environ['TR_CONFIG'] = 'bench_config.BenchConfig'
+
+from flask import render_template  # noqa: E402
+
+from app import app, db  # noqa: E402
+from tr.models import POST_POSTED, MastodonHost, Post, User, nl2br  # noqa: E402
+from tr.pagination import keyset_query  # noqa: E402
+from tr.queries import FeedPost, feed_items, feed_posts, with_author  # noqa: E402
+
+HOSTS = 20
+USERS = 200
+
+COMMENT = "Been playing this on repeat all week.\n\nThe second half of the record is where it really opens up,\nespecially the closer."
+
+
+def seed(n):
+    db.drop_all()
+    db.create_all()
+
+    now = datetime.utcnow()
+    hosts = [MastodonHost(hostname=f'host{i}.example', client_id='id', client_secret='secret') for i in range(HOSTS)]
+    users = [User(mastodon_access_code='code', mastodon_user=f'user{i}', mastodon_host=hosts[i % HOSTS])
+             for i in range(USERS)]
+    links = ['https://soundcloud.com/artist/track', 'https://artist.bandcamp.com/track/song',
+             'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC']
+
+    for i in range(n):
+        post = Post(user=users[i % USERS],
+                    comment=f'{COMMENT} #{i}',
+                    share_link=links[i % len(links)],
+                    title='title',
+                    album_art='https://example.com/a.jpg',
+                    state=POST_POSTED,
+                    created=now - timedelta(hours=i))
+        post.mark_posted(100000 + i)
+        post.updated = now - timedelta(hours=i)
+        db.session.add(post)
+
+    db.session.commit()
+    db.session.remove()
+
+
+def orm_items(n) -> list:
+    posts = keyset_query(with_author(db.session.query(Post)).filter_by(posted=True), Post.updated, Post.id, n).all()
+
+    return [FeedPost(id=p.id,
+                     updated=p.updated,
+                     user_id=p.user_id,
+                     album_art=p.album_art,
+                     comment_html=nl2br(p.comment),
+                     song_link=p.song_link,
+                     post_link=p.post_link,
+                     relative_date=p.relative_date,
+                     mastodon_user=p.user.mastodon_user,
+                     profile_link=p.user.profile_link) for p in posts[:n]]
+
+
+def read_model_items(n) -> list:
+    return feed_items(keyset_query(feed_posts(db.session), Post.updated, Post.id, n).all()[:n])
+
+
+def render(items) -> str:
+    return ''.join(render_template('card.html.j2', post=p, owner=False) for p in items)
+
+
+def measure(load, n, rounds) -> tuple:
+    """ Best of `rounds` for (loading the cards, rendering them) in seconds """
+
+    best_load = best_render = None
+
+    for _ in range(rounds):
+        db.session.remove()
+
+        start = time.perf_counter()
+        items = load(n)
+        loaded = time.perf_counter()
+        html = render(items)
+        rendered = time.perf_counter()
+
+        assert len(items) == n and html
+
+        best_load = min(best_load or loaded - start, loaded - start)
+        best_render = min(best_render or rendered - loaded, rendered - loaded)
+
+    return best_load, best_render
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Feed render benchmark')
+    parser.add_argument('--sizes', default='50,500,5000')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    print(f"{'posts':>6} {'mode':12} {'load':>9} {'render':>9} {'total':>9} {'per card':>9}")
+
+    with app.app_context(), app.test_request_context('/'):
+        for n in sizes:
+            seed(n)
+
+            for mode, load in (('orm', orm_items), ('read model', read_model_items)):
+                load_time, render_time = measure(load, n, args.rounds)
+                total = load_time + render_time
+
+                print(f"{n:6} {mode:12} {load_time * 1000:7.1f}ms {render_time * 1000:7.1f}ms "
+                      f"{total * 1000:7.1f}ms {total / n * 1e6:7.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Compare the old full-page metadata fetch (whole body + MetadataParser)
+with the streaming head-only fetch in tr/og.py.
+
+Every page in tools/fixtures/*.html is served from a local HTTP server so
+bytes are measured off the wire.
+
+    pipenv run python tools/bench_og.py [--rounds 50]
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = ROOT / 'tools' / 'fixtures'
+
+sys.path.insert(0, str(ROOT))
+
+from metadata_parser import MetadataParser  # noqa: E402
+
+from tr import http_client, og  # noqa: E402
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def translate_path(self, path):
+        # serve the fixtures whatever the working directory; `directory=` needs Python 3.7
+        return os.path.join(str(FIXTURES), os.path.relpath(super().translate_path(path), os.getcwd()))
+
+
+class QuietServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # head-only fetches hang up mid-body on purpose
+        pass
+
+
+def full_page(url):
+    r = http_client.client.get(url)
+    mp = MetadataParser(html=r.text, search_head_only=True)
+    return mp.metadata['og']['title'], mp.metadata['og']['image']
+
+
+def head_only(url):
+    r = og.fetch_head(url)
+    return r.og['title'], r.og['image']
+
+
+def measure(fn, url, rounds):
+    http_client.configure({})
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        result = fn(url)
+
+    elapsed = time.perf_counter() - start
+    return result, elapsed / rounds, http_client.client.bytes_read / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='og: fetch benchmark')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    server = QuietServer(('127.0.0.1', 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"{'fixture':30} {'path':10} {'bytes/req':>10} {'ms/req':>8}")
+
+    for fixture in sorted(FIXTURES.glob('*.html')):
+        url = f"{base}/{fixture.name}"
+
+        full_result, full_time, full_bytes = measure(full_page, url, args.rounds)
+        head_result, head_time, head_bytes = measure(head_only, url, args.rounds)
+
+        if full_result != head_result:
+            print(f"  MISMATCH {full_result} != {head_result}")
+
+        print(f"{fixture.name:30} {'full':10} {full_bytes:10.0f} {full_time * 1000:8.2f}")
+        print(f"{'':30} {'head-only':10} {head_bytes:10.0f} {head_time * 1000:8.2f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Walk a synthetic backlog of unsent posts the way the worker used to (one
+query over every pending post, objects kept in the session for the whole
+run) and with tr.queries.iter_batches, reporting peak RSS and rows/sec.
+
+The old pattern slows down quadratically, since every commit expires every
+object still in the session, so it stops after --time-limit seconds; all
+of its rows have been loaded by then, so its peak RSS is already reached.
+Each mode runs in its own process so the peak RSS figures don't mix:
+
+    pipenv run python tools/bench_queue.py [--posts 100000] [--batch-size 25] [--time-limit 30]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from tr.models import MastodonHost, Post, User, metadata  # noqa: E402
+from tr.queries import iter_batches, pending_posts  # noqa: E402
+
+USERS = 500
+
+
+def create_engine_for(path):
+    engine = create_engine(f'sqlite:///{path}')
+
+    @event.listens_for(engine, 'connect')
+    def no_fsync(conn, record):
+        # the benchmark is about the ORM, not the disk
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA journal_mode=MEMORY')
+
+    return engine
+
+
+def seed(path, posts):
+    engine = create_engine_for(path)
+    metadata.create_all(engine)
+    now = datetime.now()
+
+    with engine.begin() as conn:
+        conn.execute(MastodonHost.__table__.insert(),
+                     [{'id': i, 'hostname': f'host{i}.example', 'client_id': 'id', 'client_secret': 'secret'}
+                      for i in range(1, 51)])
+        conn.execute(User.__table__.insert(),
+                     [{'id': i, 'mastodon_access_code': 'token', 'mastodon_user': f'user{i}',
+                       'mastodon_host_id': i % 50 + 1} for i in range(1, USERS + 1)])
+
+        for start in range(0, posts, 10000):
+            conn.execute(Post.__table__.insert(),
+                         [{'user_id': i % USERS + 1, 'comment': 'x' * 200,
+                           'share_link': f'https://song.link/i/{i}', 'title': f'Song {i}',
+                           'album_art': f'https://example.com/{i}.jpg', 'posted': False, 'state': 'pending',
+                           'attempts': 0, 'metadata_queued': False, 'metadata_attempts': 0, 'created': now}
+                          for i in range(start, min(start + 10000, posts))])
+
+    # give the planner the row counts MySQL would have, so it walks the primary key
+    engine.execute('ANALYZE')
+    engine.dispose()
+
+
+def process(session, post):
+    post.user.mastodon_host.hostname
+    post.last_error = 'benchmark'
+    session.commit()
+
+
+def run_unbatched(engine, batch_size, deadline):
+    session = Session(engine)
+    count = 0
+
+    for post in pending_posts(session):
+        process(session, post)
+        count += 1
+
+        if time.perf_counter() > deadline:
+            break
+
+    return count
+
+
+def run_batched(engine, batch_size, deadline):
+    session = Session(engine, expire_on_commit=False)
+    count = 0
+
+    for batch in iter_batches(session, pending_posts(session), batch_size):
+        for post in batch:
+            process(session, post)
+            count += 1
+
+            if time.perf_counter() > deadline:
+                return count
+
+    return count
+
+
+MODES = {'unbatched': run_unbatched, 'batched': run_batched}
+
+
+def run_mode(path, mode, batch_size, time_limit):
+    engine = create_engine_for(path)
+    start = time.perf_counter()
+    count = MODES[mode](engine, batch_size, start + time_limit)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"{mode:10} {count:7} rows  {count / elapsed:8.0f} rows/s  peak RSS {peak:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker queue memory benchmark')
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=25)
+    parser.add_argument('--time-limit', type=float, default=30)
+    parser.add_argument('--mode', choices=sorted(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.db, args.mode, args.batch_size, args.time_limit)
+        return
+
+    tmp = tempfile.mkdtemp()
+    template = os.path.join(tmp, 'template.db')
+    seed(template, args.posts)
+
+    print(f"{args.posts} pending posts, batch size {args.batch_size}")
+
+    for mode in ('unbatched', 'batched'):
+        # every mode gets an untouched copy of the backlog
+        path = os.path.join(tmp, f'{mode}.db')
+        Path(path).write_bytes(Path(template).read_bytes())
+
+        subprocess.run([sys.executable, __file__, '--mode', mode, '--db', path,
+                        '--batch-size', str(args.batch_size), '--time-limit', str(args.time_limit)], check=True)
+
+
+if __name__ == '__main__':
+    main()
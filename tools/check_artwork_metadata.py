@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Fail if normalized artwork keeps any of the original's EXIF, ICC or text
+metadata. JPEG and PNG originals carrying all three are normalized to
+every format ARTWORK_FORMAT accepts and the output is read back:
+
+    pipenv run python tools/check_artwork_metadata.py
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from PIL import Image, ImageCms, PngImagePlugin  # noqa: E402
+
+from tr import imaging  # noqa: E402
+
+# a GPS position in the EXIF is what must never reach the public artwork store
+GPS_INFO = 0x8825
+MAKE = 0x010F
+
+
+def make_original(path, image_format):
+    im = Image.new('RGB', (1600, 1600), (200, 40, 90))
+
+    exif = Image.Exif()
+    exif[MAKE] = 'Example Camera'
+    exif[GPS_INFO] = {1: 'N', 2: (52.0, 22.0, 0.0), 3: 'E', 4: (4.0, 53.0, 0.0)}
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+    options = {'exif': exif.tobytes(), 'icc_profile': icc}
+
+    if image_format == 'PNG':
+        text = PngImagePlugin.PngInfo()
+        text.add_text('Comment', 'shot at home')
+        options['pnginfo'] = text
+
+    im.save(path, image_format, **options)
+
+    with Image.open(path) as saved:
+        assert saved.info.get('exif') and saved.info.get('icc_profile'), f"{path} was written without metadata"
+
+
+def leftovers(path) -> list:
+    with Image.open(path) as im:
+        found = [key for key in ('exif', 'icc_profile', 'Comment') if im.info.get(key)]
+
+        if im.getexif():
+            found.append('exif tags')
+
+    return found
+
+
+def main():
+    tmp = Path(tempfile.mkdtemp())
+    ok = True
+
+    for source_format in ('JPEG', 'PNG'):
+        source = tmp / f'original{imaging.EXTENSIONS[source_format]}'
+        make_original(str(source), source_format)
+
+        for image_format, extension in sorted(imaging.EXTENSIONS.items()):
+            dest = tmp / f'normalized-{source_format}{extension}'
+            imaging.normalize(str(source), str(dest), image_format=image_format)
+            found = leftovers(str(dest))
+
+            print(f"{'ok  ' if not found else 'FAIL'} {source_format} -> {image_format}"
+                  + (f" (kept {', '.join(found)})" if found else ''))
+            ok = ok and not found
+
+            os.unlink(str(dest))
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
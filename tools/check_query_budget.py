@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Fail if rendering the feed or walking the worker queue issues a number of
+SQL statements that grows with the number of posts, or if the worker's
+run_posts() loop reads anything per post. Each post it handles is written
+on its own, so only its SELECTs are budgeted.
+
+Runs against a throwaway SQLite database:
+
+    pipenv run python tools/check_query_budget.py
+"""
+import logging
+import os
+import sys
+import tempfile
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(str(ROOT))
+
+from defaults import DefaultConfig  # noqa: E402
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'budget.db')
+
+FEED_BUDGET = 4
+WORKER_BUDGET = 2
+RUN_POSTS_BUDGET = 2
+
+
+class BudgetConfig(DefaultConfig):
+    SQLALCHEMY_DATABASE_URI = f'sqlite:///{DB_PATH}'
+    FEED_CACHE_STAMP = os.path.join(tempfile.mkdtemp(), 'feed.stamp')
+    METADATA_CACHE_DB = False
+    SEND = False
+    # one queue batch holds every seeded post, so the SELECT count only changes if something loads per post
+    WORKER_QUEUE_BATCH = 100
+
+
+budget_config = types.ModuleType('budget_config')
+budget_config.BudgetConfig = BudgetConfig
+sys.modules['budget_config'] = budget_config
+# the worker loads its settings by class name from the config module
+sys.modules['config'] = budget_config
+os.environ['TR_CONFIG'] = 'budget_config.BudgetConfig'
+
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app import app, db  # noqa: E402
+from tr import feed_cache  # noqa: E402
+from tr.leases import claim_posts  # noqa: E402
+from tr.models import POST_PENDING, POST_POSTED, MastodonHost, Post, User  # noqa: E402
+from tr.queries import QueryCounter, pending_posts  # noqa: E402
+from tr.worker import Worker  # noqa: E402
+
+
+def seed(n):
+    db.drop_all()
+    db.create_all()
+
+    now = datetime.utcnow()
+
+    for i in range(n):
+        host = MastodonHost(hostname=f'host{i}.example', client_id='id', client_secret='secret')
+        user = User(mastodon_access_code='code', mastodon_user=f'user{i}', mastodon_host=host)
+        db.session.add(Post(user=user,
+                            comment=f'post {i}',
+                            share_link='https://soundcloud.com/a/b',
+                            title='title',
+                            album_art='https://example.com/a.jpg',
+                            posted=i % 2 == 0,
+                            state=POST_POSTED if i % 2 == 0 else POST_PENDING,
+                            status_id=i,
+                            created=now - timedelta(hours=i),
+                            updated=now - timedelta(hours=i)))
+
+    db.session.commit()
+    db.session.remove()
+
+
+def feed_statements(n) -> int:
+    with app.app_context():
+        seed(n)
+        feed_cache.cache.pages.clear()
+        feed_cache.cache.cards.clear()
+
+        with QueryCounter(db.engine) as counter:
+            r = app.test_client().get('/')
+            assert r.status_code == 200, r.status_code
+
+    return counter.count
+
+
+def worker_statements(n) -> int:
+    with app.app_context():
+        seed(n)
+        session = Session(db.engine, expire_on_commit=False)
+
+        with QueryCounter(db.engine) as counter:
+            for post in pending_posts(session):
+                post.user.mastodon_user
+                post.user.mastodon_host.hostname
+
+        session.close()
+
+    return counter.count
+
+
+def run_posts_selects(n) -> int:
+    with app.app_context():
+        seed(n)
+
+    worker = Worker('BudgetConfig')
+    logging.getLogger('worker').setLevel(logging.WARNING)
+    session = Session(worker.engine)
+    post_ids = claim_posts(session, worker.owner, n, 600)
+    session.close()
+
+    with QueryCounter(worker.engine) as counter:
+        worker.run_posts(post_ids)
+
+    assert worker.counts['skipped'] == len(post_ids), worker.counts
+    worker.close()
+
+    return sum(1 for statement in counter.statements if statement.lstrip().upper().startswith('SELECT'))
+
+
+def check(name, measure, budget, what='statements') -> bool:
+    counts = {n: measure(n) for n in (2, 10, 40)}
+    ok = max(counts.values()) <= budget and len(set(counts.values())) == 1
+
+    print(f"{'ok  ' if ok else 'FAIL'} {name}: {what} by post count {counts}, budget {budget}")
+    return ok
+
+
+def main():
+    results = [
+        check('feed render', feed_statements, FEED_BUDGET),
+        check('worker queue', worker_statements, WORKER_BUDGET),
+        check('worker run_posts', run_posts_selects, RUN_POSTS_BUDGET, 'SELECTs'),
+    ]
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
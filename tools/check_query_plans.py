@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Fail if any hot query is planned as a full table scan.
+
+Each query below is run against a seeded SQLite database and every
+statement it issues is put through EXPLAIN QUERY PLAN. Every query is also
+compiled for MySQL, so dialect-specific syntax errors show up here too. Pass
+--mysql with a scratch database URL to EXPLAIN them on MySQL as well
+(the tables are created there and dropped afterwards):
+
+    pipenv run python tools/check_query_plans.py [--mysql mysql+pymysql://user:pw@host/scratch]
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.dialects import mysql  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from tr.models import MastodonHost, Post, User, metadata  # noqa: E402
+from tr.pagination import NEWER, OLDER, keyset_query  # noqa: E402
+from tr.queries import QueryCounter, feed_posts  # noqa: E402
+
+HOSTS = 20
+USERS = 200
+POSTS = 2000
+PAGE_SIZE = 20
+
+MIDDLE = (datetime(2019, 1, 1) + timedelta(minutes=POSTS // 2), POSTS // 2)
+
+HOT_QUERIES = [
+    ('feed, first page',
+     lambda s: keyset_query(feed_posts(s), Post.updated, Post.id, PAGE_SIZE)),
+    ('feed, older page',
+     lambda s: keyset_query(feed_posts(s), Post.updated, Post.id, PAGE_SIZE, MIDDLE, OLDER)),
+    ('feed, newer page',
+     lambda s: keyset_query(feed_posts(s), Post.updated, Post.id, PAGE_SIZE, MIDDLE, NEWER)),
+    ('user by account id',
+     lambda s: s.query(User).filter_by(mastodon_account_id=1005, mastodon_host_id=6).limit(1)),
+    ('user by username',
+     lambda s: s.query(User).filter_by(mastodon_user='user5', mastodon_host_id=6).limit(1)),
+    ('host by hostname',
+     lambda s: s.query(MastodonHost).filter_by(hostname='host5.example').limit(1)),
+]
+
+
+def seed(engine):
+    metadata.create_all(engine)
+    start = datetime(2019, 1, 1)
+
+    with engine.begin() as conn:
+        conn.execute(MastodonHost.__table__.insert(),
+                     [{'id': i, 'hostname': f'host{i}.example', 'client_id': 'id', 'client_secret': 'secret'}
+                      for i in range(1, HOSTS + 1)])
+        conn.execute(User.__table__.insert(),
+                     [{'id': i, 'mastodon_access_code': 'token', 'mastodon_user': f'user{i}',
+                       'mastodon_account_id': 1000 + i, 'mastodon_host_id': i % HOSTS + 1}
+                      for i in range(1, USERS + 1)])
+        conn.execute(Post.__table__.insert(),
+                     [{'id': i, 'user_id': i % USERS + 1, 'comment': 'comment',
+                       'share_link': f'https://song.link/i/{i}', 'posted': i % 10 != 0,
+                       'state': 'posted' if i % 10 else 'pending', 'attempts': 0,
+                       'metadata_queued': False, 'metadata_attempts': 0,
+                       'created': start + timedelta(minutes=i), 'updated': start + timedelta(minutes=i)}
+                      for i in range(1, POSTS + 1)])
+
+
+def captured(engine, build):
+    """ The statements and parameters `build`'s query sends to the database """
+
+    session = Session(engine)
+
+    with QueryCounter(engine) as counter:
+        build(session).all()
+
+    session.close()
+
+    return list(zip(counter.statements, counter.parameters))
+
+
+def sqlite_scans(engine, statement, parameters) -> list:
+    raw = engine.raw_connection()
+
+    try:
+        cursor = raw.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        details = [row[-1] for row in cursor.fetchall()]
+    finally:
+        raw.close()
+
+    # "SCAN posts" reads the whole table; "SCAN posts USING INDEX ..." walks an index in order
+    return [d for d in details if d.startswith('SCAN ') and ' USING ' not in d]
+
+
+def mysql_scans(engine, statement, parameters) -> list:
+    raw = engine.raw_connection()
+
+    try:
+        cursor = raw.cursor()
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        columns = [c[0] for c in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        raw.close()
+
+    return [f"{row['table']}: full scan" for row in rows if row['type'] == 'ALL']
+
+
+def check(engine, explain, label) -> bool:
+    ok = True
+
+    for name, build in HOT_QUERIES:
+        scans = []
+
+        for statement, parameters in captured(engine, build):
+            scans.extend(explain(engine, statement, parameters))
+
+        print(f"{'ok  ' if not scans else 'FAIL'} {label}: {name}" + (f" ({'; '.join(scans)})" if scans else ''))
+        ok = ok and not scans
+
+    return ok
+
+
+def check_mysql_syntax() -> bool:
+    ok = True
+    session = Session()
+
+    for name, build in HOT_QUERIES:
+        try:
+            build(session).statement.compile(dialect=mysql.dialect())
+        except Exception as e:
+            print(f"FAIL mysql syntax: {name} ({e})")
+            ok = False
+
+    session.close()
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query plan regression check')
+    parser.add_argument('--mysql', help='URL of a scratch MySQL database to EXPLAIN on')
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}")
+    seed(engine)
+    engine.execute('ANALYZE')
+
+    ok = check(engine, sqlite_scans, 'sqlite')
+    ok = check_mysql_syntax() and ok
+
+    if args.mysql:
+        mysql_engine = create_engine(args.mysql)
+        seed(mysql_engine)
+        mysql_engine.execute('ANALYZE TABLE mastodon_host, users, posts')
+
+        try:
+            ok = check(mysql_engine, mysql_scans, 'mysql') and ok
+        finally:
+            metadata.drop_all(mysql_engine)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
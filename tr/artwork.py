@@ -0,0 +1,278 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import logging
+import time
+from pathlib import Path
+
+from tr import http_client, imaging, metrics
+from tr.metadata_cache import cache_key
+
+
+l = logging.getLogger('artwork')
+
+
+class ArtworkError(Exception):
+    pass
+
+
+def extension_for(content_type) -> str:
+    content_type = (content_type or '').split(';')[0].strip().lower()
+
+    if not content_type.startswith('image/'):
+        raise ArtworkError(f"Not an image: {content_type or 'no content type'}")
+
+    extension = mimetypes.guess_extension(content_type)
+
+    # ffs
+    if extension in (None, '.jpe'):
+        extension = '.jpg'
+
+    return extension
+
+
+class ArtworkStore(object):
+    """
+    Album art on disk, stored once per image content.
+
+        root/blobs/ab/<sha256>.jpg  the image, named by the hash of its bytes
+        root/urls/<sha1 of url>     "<sha256>.jpg", which blob a URL gave us
+
+    Downloads are streamed to a temp file in the store and renamed into
+    place, so a crashed download never leaves a half-written blob and the
+    temp file is always removed. Every use touches the blob's mtime; once
+    the store is over `max_bytes` the least recently used blobs go first,
+    except those used in the last `min_age` seconds, which may be uploading.
+
+    With Pillow installed, `upload_file()` also keeps a copy of each image
+    scaled down to `max_dimension` and re-encoded without its metadata,
+    named after the original blob and the settings that produced it.
+    """
+
+    min_age = 300
+
+    def __init__(self, root='tmp/artwork', max_bytes=256 * 1024 * 1024, max_file_bytes=8 * 1024 * 1024,
+                 max_dimension=1024, quality=85, image_format='JPEG'):
+        self.root = Path(root)
+        self.blobs = self.root / 'blobs'
+        self.urls = self.root / 'urls'
+        self.tmp = self.root / 'tmp'
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.image_format = image_format
+
+        self._lock = threading.Lock()
+        # workers sharing an album wait for one download rather than each starting their own
+        self._url_locks = [threading.RLock() for _ in range(32)]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+
+        for path in (self.blobs, self.urls, self.tmp):
+            path.mkdir(parents=True, exist_ok=True)
+
+    def _url_lock(self, url):
+        return self._url_locks[hash(url) % len(self._url_locks)]
+
+    def _url_path(self, url) -> Path:
+        return self.urls / cache_key(url)
+
+    def _blob_path(self, name) -> Path:
+        return self.blobs / name[:2] / name
+
+    def get(self, url):
+        """ The stored file for `url`, or None """
+
+        url_path = self._url_path(url)
+
+        try:
+            name = url_path.read_text().strip()
+        except FileNotFoundError:
+            return None
+
+        path = self._blob_path(name)
+
+        try:
+            os.utime(str(path))
+        except FileNotFoundError:
+            # the blob was evicted
+            try:
+                url_path.unlink()
+            except FileNotFoundError:
+                pass
+            return None
+
+        return path
+
+    def fetch(self, url) -> Path:
+        """ The stored file for `url`, downloading it first if needed """
+
+        with self._url_lock(url):
+            path = self.get(url)
+
+            if path:
+                with self._lock:
+                    self.hits += 1
+                metrics.CACHE_LOOKUPS.inc(cache='artwork', result='hit')
+                return path
+
+            with self._lock:
+                self.misses += 1
+            metrics.CACHE_LOOKUPS.inc(cache='artwork', result='miss')
+
+            return self._download(url)
+
+    def _download(self, url) -> Path:
+        fd, tmp = tempfile.mkstemp(dir=str(self.tmp))
+
+        try:
+            digest = hashlib.sha256()
+
+            with os.fdopen(fd, 'wb') as f:
+                r = http_client.client.get(url, stream=True)
+
+                try:
+                    r.raise_for_status()
+                    extension = extension_for(r.headers.get('Content-Type'))
+
+                    for chunk in http_client.client.iter_content(r, max_bytes=self.max_file_bytes):
+                        digest.update(chunk)
+                        f.write(chunk)
+                finally:
+                    r.close()
+
+            name = digest.hexdigest() + extension
+            path = self._blob_path(name)
+            path.parent.mkdir(exist_ok=True)
+            os.replace(tmp, str(path))
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+        self._write_url(url, name)
+        self.evict()
+
+        return path
+
+    def upload_file(self, url) -> Path:
+        """ The file to upload for `url`: the normalized copy if that came out smaller, else the original """
+
+        with self._url_lock(url):
+            path = self.fetch(url)
+
+            if not self.max_dimension or not imaging.available():
+                return path
+
+            return self._normalize(url, path)
+
+    def _normalize(self, url, path) -> Path:
+        stem = path.name.split('.')[0]
+        extension = imaging.EXTENSIONS[self.image_format]
+        normalized = path.with_name(f"{stem}-{self.max_dimension}q{self.quality}{extension}")
+
+        try:
+            os.utime(str(normalized))
+        except FileNotFoundError:
+            fd, tmp = tempfile.mkstemp(dir=str(self.tmp), suffix=extension)
+            os.close(fd)
+
+            try:
+                imaging.normalize(str(path), tmp, self.max_dimension, self.quality, self.image_format)
+                os.replace(tmp, str(normalized))
+            except Exception as e:
+                # Pillow can't read it; Mastodon may still be able to
+                l.warning(f"Uploading {url} as is: {e}")
+                return path
+            finally:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+
+        saved = path.stat().st_size - normalized.stat().st_size
+
+        if saved <= 0:
+            # already small and well compressed; re-encoding only made it bigger
+            return path
+
+        with self._lock:
+            self.bytes_saved += saved
+
+        return normalized
+
+    def _write_url(self, url, name) -> None:
+        fd, tmp = tempfile.mkstemp(dir=str(self.tmp))
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(name)
+
+        os.replace(tmp, str(self._url_path(url)))
+
+    def _entries(self) -> list:
+        entries = []
+
+        for path in self.blobs.glob('*/*'):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((st.st_mtime, st.st_size, path))
+
+        return entries
+
+    def evict(self) -> int:
+        """ Remove least recently used blobs until the store fits in `max_bytes` """
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        recent = time.time() - self.min_age
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes or mtime > recent:
+                break
+
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.evictions += removed
+
+        return removed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes_saved': self.bytes_saved,
+            'files': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+        }
+
+
+store = None
+
+
+def configure(config) -> ArtworkStore:
+    global store
+
+    store = ArtworkStore(root=config.get('ARTWORK_DIR', 'tmp/artwork'),
+                         max_bytes=config.get('ARTWORK_STORE_BYTES', 256 * 1024 * 1024),
+                         max_file_bytes=config.get('ARTWORK_MAX_BYTES', 8 * 1024 * 1024),
+                         max_dimension=config.get('ARTWORK_MAX_DIMENSION', 1024),
+                         quality=config.get('ARTWORK_QUALITY', 85),
+                         image_format=config.get('ARTWORK_FORMAT', 'JPEG'))
+
+    return store
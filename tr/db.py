@@ -0,0 +1,85 @@
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+
+
+def engine_options(config, url) -> dict:
+    """
+    create_engine() keyword arguments shared by the web app and the workers.
+    Connections are pinged when checked out of the pool and recycled before
+    MySQL's wait_timeout drops them, so callers never need to probe first.
+    """
+
+    url = make_url(url)
+    options = {
+        'pool_pre_ping': True,
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+    }
+
+    if url.drivername.startswith('sqlite'):
+        options['connect_args'] = {'timeout': config.get('DB_CONNECT_TIMEOUT', 10)}
+    else:
+        options['pool_size'] = config.get('DB_POOL_SIZE', 5)
+        options['max_overflow'] = config.get('DB_MAX_OVERFLOW', 10)
+        options['pool_timeout'] = config.get('DB_POOL_TIMEOUT', 10)
+
+        if url.drivername.startswith('mysql'):
+            options['connect_args'] = {'connect_timeout': config.get('DB_CONNECT_TIMEOUT', 10)}
+
+    return options
+
+
+def create_db_engine(config):
+    url = config['SQLALCHEMY_DATABASE_URI']
+    return create_engine(url, **engine_options(config, url))
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy with the same engine options the workers use """
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+
+        for key, value in engine_options(app.config, info).items():
+            if key == 'connect_args':
+                options.setdefault('connect_args', {}).update(value)
+            elif key in ('pool_size', 'max_overflow', 'pool_timeout') and 'poolclass' in options:
+                # Flask-SQLAlchemy picked a NullPool/StaticPool that takes no sizing
+                continue
+            else:
+                options[key] = value
+
+
+class HealthCheck(object):
+    """
+    `SELECT 1` against the database, run at most once every `interval`
+    seconds; callers in between get the cached answer.
+    """
+
+    def __init__(self, engine_getter, interval=30):
+        self.engine_getter = engine_getter
+        self.interval = interval
+        self.checked_at = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def check(self, force=False) -> bool:
+        with self._lock:
+            if force or time.time() - self.checked_at >= self.interval:
+                try:
+                    with self.engine_getter().connect() as conn:
+                        conn.execute('SELECT 1')
+                    self.error = None
+                except exc.SQLAlchemyError as e:
+                    self.error = e
+
+                self.checked_at = time.time()
+
+        return self.ok
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from tr import metrics
+from tr.metadata_cache import LRUCache
+
+
+class FeedCache(object):
+    """
+    Rendered output for the community feed: whole pages for anonymous
+    visitors and per-post card fragments for everyone else.
+
+    Anything that changes what the feed shows (the worker posting, a user
+    deleting a post) calls `invalidate()`, which rewrites a small stamp
+    file. Every process compares the stamp with the one its pages were
+    rendered against, so the web app notices changes made by the worker
+    with a single stat() per request.
+
+    Cards show how long ago each post was sent, so card keys include that
+    text and pages are only shared within the same `page_period` seconds.
+    """
+
+    page_period = 60
+
+    def __init__(self, stamp_path='tmp/feed.stamp', maxsize=256, ttl=3600):
+        self.stamp = Path(stamp_path)
+        self.pages = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.cards = LRUCache(maxsize=maxsize * 8, ttl=ttl)
+
+    def version(self):
+        try:
+            st = self.stamp.stat()
+        except FileNotFoundError:
+            return None
+
+        return st.st_ino, st.st_mtime_ns
+
+    def invalidate(self) -> None:
+        self.stamp.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=str(self.stamp.parent))
+        with os.fdopen(fd, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp, str(self.stamp))
+
+        self.pages.clear()
+
+    def _page_key(self, key) -> tuple:
+        return self.version(), int(time.time() // self.page_period), key
+
+    def get_page(self, key):
+        html = self.pages.get(self._page_key(key))
+        metrics.CACHE_LOOKUPS.inc(cache='feed_page', result='miss' if html is None else 'hit')
+        return html
+
+    def set_page(self, key, html) -> None:
+        self.pages.set(self._page_key(key), html)
+
+    def card(self, post, owner, render):
+        """
+        The card for `post`, rendered by `render()` on a miss. Cards are keyed
+        by post id and `updated` so an edited post never serves stale HTML,
+        by its album art, which the metadata worker can fill in later, and by
+        its relative date so "today" turns into "yesterday" on time.
+        """
+
+        key = (post.id, post.updated, post.album_art, post.relative_date, owner)
+        html = self.cards.get(key)
+        metrics.CACHE_LOOKUPS.inc(cache='feed_card', result='miss' if html is None else 'hit')
+
+        if html is None:
+            html = render()
+            self.cards.set(key, html)
+
+        return html
+
+
+cache = FeedCache()
+
+
+def configure(config) -> FeedCache:
+    global cache
+
+    cache = FeedCache(stamp_path=config.get('FEED_CACHE_STAMP', 'tmp/feed.stamp'),
+                      maxsize=config.get('FEED_CACHE_SIZE', 256),
+                      ttl=config.get('FEED_CACHE_TTL', 3600))
+
+    return cache
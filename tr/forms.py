@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, TextAreaField, RadioField, SelectField
+from wtforms import HiddenField, StringField, TextAreaField, RadioField, SelectField
 from wtforms.fields.html5 import URLField
 from wtforms.validators import DataRequired, Email, length, url
 
@@ -17,3 +17,4 @@ class SubmissionForm(FlaskForm):
         ('unlisted', 'Public but not visible on server timelines'),
         ('direct', 'Hidden on Mastodon but still visible here')
     ])
+    preview_token = HiddenField()
@@ -1,6 +1,7 @@
 from flask import url_for
 from mastodon import Mastodon, MastodonNetworkError
 
+from tr import mastodon_clients
 from tr.models import MastodonHost
 
 
@@ -38,15 +39,10 @@ def mastodon_api(db, app, hostname, access_code=None):
     mastodonhost = get_or_create_host(db, app, hostname)
 
     if mastodonhost:
-        api = Mastodon(
-                client_id=mastodonhost.client_id,
-                client_secret=mastodonhost.client_secret,
-                api_base_url=f"https://{mastodonhost.hostname}",
-                access_token=access_code,
-                debug_requests=False
-        )
-
-        return api
+        return mastodon_clients.clients.get(f"https://{mastodonhost.hostname}",
+                                            mastodonhost.client_id,
+                                            mastodonhost.client_secret,
+                                            access_code)
     return None
 
 
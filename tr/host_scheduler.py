@@ -0,0 +1,214 @@
+import random
+import threading
+import time
+
+
+class HostBusy(Exception):
+    """ Raised instead of waiting when a host won't accept requests for a while """
+
+    def __init__(self, hostname, retry_in):
+        super().__init__(f"{hostname} busy for {retry_in:.0f}s")
+        self.hostname = hostname
+        self.retry_in = retry_in
+
+
+class HostState(object):
+    """
+    Token bucket and backoff for one Mastodon instance, or one account on it.
+    The bucket is refilled at limit / window tokens per second and resynced
+    with X-RateLimit-Remaining after every response, so it never drifts far
+    from what the server thinks.
+    """
+
+    def __init__(self, hostname, limit=300, window=300, reserve=5):
+        self.hostname = hostname
+        self.limit = limit
+        self.window = window
+        self.reserve = reserve
+        self.tokens = float(limit - reserve)
+        self.updated = time.time()
+        self.reset_at = 0
+        self.retry_at = 0
+        self.failures = 0
+        self.last_error = None
+        self.requests = 0
+
+    @property
+    def rate(self) -> float:
+        return self.limit / self.window
+
+    def refill(self, now) -> None:
+        if self.reset_at and now >= self.reset_at:
+            self.tokens = float(self.limit - self.reserve)
+            self.reset_at = 0
+        else:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.limit - self.reserve)
+
+        self.updated = now
+
+    def wait(self, now) -> float:
+        """ Seconds until a request may be made, 0 if one may be made now """
+
+        if self.retry_at > now:
+            return self.retry_at - now
+
+        self.refill(now)
+
+        if self.tokens >= 1:
+            return 0
+
+        if self.reset_at:
+            return max(min(self.reset_at - now, (1 - self.tokens) / self.rate), 0)
+
+        return (1 - self.tokens) / self.rate
+
+    def as_dict(self, now) -> dict:
+        return {
+            'tokens': round(self.tokens, 1),
+            'limit': self.limit,
+            'reset_in': round(max(self.reset_at - now, 0)),
+            'retry_in': round(max(self.retry_at - now, 0)),
+            'failures': self.failures,
+            'requests': self.requests,
+            'last_error': self.last_error,
+        }
+
+
+class HostScheduler(object):
+    """
+    Decides when each Mastodon instance may be sent the next request.
+
+    Mastodon budgets requests per access token, so requests are paced by
+    the rate limit headers of each account on an instance (`account` is
+    whatever identifies the token, never the token itself) instead of being
+    sent until they answer 429. One account running out of requests only
+    holds up that account. Failures are the instance's, so they back the
+    whole host off exponentially (with jitter so that workers don't retry
+    in lockstep) rather than for a flat penalty.
+    """
+
+    def __init__(self, base_delay=30, max_delay=3600, window=300, reserve=5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.reserve = reserve
+        self.hosts = {}
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def _state(self, hostname) -> HostState:
+        state = self.hosts.get(hostname)
+
+        if state is None:
+            state = self.hosts[hostname] = HostState(hostname, window=self.window, reserve=self.reserve)
+
+        return state
+
+    def _bucket(self, hostname, account) -> HostState:
+        key = (hostname, account)
+        bucket = self.buckets.get(key)
+
+        if bucket is None:
+            bucket = self.buckets[key] = HostState(hostname, window=self.window, reserve=self.reserve)
+
+        return bucket
+
+    def retry_in(self, hostname, defer_until=None, account=None) -> float:
+        """
+        Seconds the host, or `account` on it, is held off for; `defer_until`
+        is the host backoff another worker recorded
+        """
+
+        now = time.time()
+
+        with self._lock:
+            state = self._state(hostname)
+
+            if defer_until is not None:
+                state.retry_at = max(state.retry_at, defer_until.timestamp())
+
+            retry_at = max(state.retry_at, self._bucket(hostname, account).retry_at)
+
+            return max(retry_at - now, 0)
+
+    def acquire(self, hostname, account=None) -> float:
+        """ Take one of `account`'s tokens if one is available; otherwise return how long to wait for one """
+
+        now = time.time()
+
+        with self._lock:
+            state = self._state(hostname)
+
+            if state.retry_at > now:
+                return state.retry_at - now
+
+            bucket = self._bucket(hostname, account)
+            wait = bucket.wait(now)
+
+            if not wait:
+                bucket.tokens -= 1
+                bucket.requests += 1
+                state.requests += 1
+
+            return wait
+
+    def observe(self, hostname, api, account=None) -> None:
+        """ Resync `account`'s bucket with the rate limit headers of `api`'s last response """
+
+        now = time.time()
+
+        with self._lock:
+            state = self._bucket(hostname, account)
+            state.limit = max(api.ratelimit_limit, 1)
+            state.tokens = float(min(api.ratelimit_remaining, state.limit) - self.reserve)
+            state.updated = now
+
+            if api.ratelimit_reset > now:
+                state.reset_at = api.ratelimit_reset
+
+    def success(self, hostname, api, account=None) -> None:
+        self.observe(hostname, api, account)
+
+        with self._lock:
+            state = self._state(hostname)
+            state.failures = 0
+            state.last_error = None
+
+    def failure(self, hostname, error) -> float:
+        """ Back off after a failed request; returns the delay in seconds """
+
+        with self._lock:
+            state = self._state(hostname)
+            state.failures += 1
+            state.last_error = str(error)[:200]
+
+            delay = min(self.base_delay * 2 ** (state.failures - 1), self.max_delay)
+            delay = random.uniform(delay / 2, delay)
+            state.retry_at = time.time() + delay
+
+            return delay
+
+    def rate_limited(self, hostname, api, account=None) -> float:
+        """ `account` got a 429: hold it off until its window resets; returns the delay in seconds """
+
+        self.observe(hostname, api, account)
+        now = time.time()
+
+        with self._lock:
+            state = self._bucket(hostname, account)
+            state.tokens = 0
+            state.last_error = 'rate limited'
+            state.retry_at = max(state.reset_at, now + self.base_delay) + random.uniform(0, self.base_delay / 2)
+
+            return state.retry_at - now
+
+    def states(self) -> dict:
+        now = time.time()
+
+        with self._lock:
+            states = {hostname: state.as_dict(now) for hostname, state in self.hosts.items()}
+
+            for (hostname, account), bucket in self.buckets.items():
+                states[hostname].setdefault('accounts', {})[account] = bucket.as_dict(now)
+
+            return states
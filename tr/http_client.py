@@ -0,0 +1,138 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'curl/7.54.0'
+
+
+class ResponseTooLarge(requests.RequestException):
+    pass
+
+
+class HTTPClient(object):
+    """
+    One pooled requests.Session for every outbound fetch (song.link,
+    Bandcamp, SoundCloud, album art) so connections and TLS sessions are
+    kept alive and reused per host instead of being set up for each call.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, connect_timeout=5, read_timeout=15,
+                 max_bytes=10 * 1024 * 1024, retries=2):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   max_retries=Retry(total=retries,
+                                                     connect=retries,
+                                                     read=retries,
+                                                     backoff_factor=0.5,
+                                                     status_forcelist=(502, 503, 504),
+                                                     raise_on_status=False))
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_read = 0
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def request(self, method, url, stream=False, **kwargs) -> requests.Response:
+        """
+        Like `requests.request` but with the client's timeouts. Unless `stream`
+        is set the body is read here and the request fails with
+        ResponseTooLarge once it passes `max_bytes`.
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+
+        try:
+            r = self.session.request(method, url, stream=True, **kwargs)
+        except requests.RequestException:
+            self._count(requests=1, errors=1)
+            raise
+
+        self._count(requests=1)
+
+        if not stream:
+            try:
+                r._content = b''.join(self.iter_content(r))
+            finally:
+                r.close()
+
+        return r
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def iter_content(self, response, chunk_size=16 * 1024, max_bytes=None, truncate=False):
+        """
+        Yield the body in chunks. Past `max_bytes` this raises
+        ResponseTooLarge, or with `truncate` simply stops reading.
+        """
+
+        max_bytes = max_bytes or self.max_bytes
+        total = 0
+
+        length = response.headers.get('Content-Length')
+        if not truncate and length and length.isdigit() and int(length) > max_bytes:
+            response.close()
+            raise ResponseTooLarge(f"{response.url} is {length} bytes, the limit is {max_bytes}")
+
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if total + len(chunk) > max_bytes:
+                if truncate:
+                    chunk = chunk[:max_bytes - total]
+                else:
+                    response.close()
+                    raise ResponseTooLarge(f"{response.url} is larger than {max_bytes} bytes")
+
+            total += len(chunk)
+            self._count(bytes_read=len(chunk))
+
+            yield chunk
+
+            if total >= max_bytes:
+                break
+
+    @property
+    def connections(self) -> int:
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self) -> dict:
+        connections = self.connections
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes_read': self.bytes_read,
+            'connections': connections,
+            'reused': max(self.requests - self.errors - connections, 0),
+        }
+
+
+client = HTTPClient()
+
+
+def configure(config) -> HTTPClient:
+    global client
+
+    client = HTTPClient(pool_connections=config.get('HTTP_POOL_CONNECTIONS', 10),
+                        pool_maxsize=config.get('HTTP_POOL_MAXSIZE', 10),
+                        connect_timeout=config.get('HTTP_CONNECT_TIMEOUT', 5),
+                        read_timeout=config.get('HTTP_READ_TIMEOUT', 15),
+                        max_bytes=config.get('HTTP_MAX_BYTES', 10 * 1024 * 1024),
+                        retries=config.get('HTTP_RETRIES', 2))
+
+    return client
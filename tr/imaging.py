@@ -0,0 +1,49 @@
+try:
+    from PIL import Image
+except ImportError:  # art is uploaded as downloaded without Pillow
+    Image = None
+
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def normalize(src, dest, max_dimension=1024, quality=85, image_format='JPEG') -> None:
+    """
+    Write a copy of the image at `src` to `dest` that fits in a
+    `max_dimension` square, re-encoded as `image_format`. Nothing from the
+    original's EXIF, ICC or text chunks is carried over.
+    """
+
+    with Image.open(src) as im:
+        if im.format == 'JPEG':
+            # let the decoder scale down by up to 8x instead of decoding every pixel
+            im.draft('RGB', (max_dimension, max_dimension))
+
+        if im.mode == 'P':
+            im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+
+        if im.mode in ('RGBA', 'LA') and image_format == 'JPEG':
+            background = Image.new('RGB', im.size, (255, 255, 255))
+            background.paste(im, mask=im.split()[-1])
+            im = background
+        elif im.mode == 'LA':
+            im = im.convert('RGBA')
+        elif im.mode not in ('RGB', 'RGBA', 'L'):
+            im = im.convert('RGB')
+
+        im.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        # the PNG and WebP encoders copy EXIF and ICC data from im.info unless told otherwise
+        im.info = {key: value for key, value in im.info.items() if key == 'transparency'}
+        options = {'optimize': True, 'exif': b'', 'icc_profile': None}
+
+        if image_format in ('JPEG', 'WEBP'):
+            options['quality'] = quality
+
+        if image_format == 'JPEG':
+            options['progressive'] = True
+
+        im.save(dest, image_format, **options)
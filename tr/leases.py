@@ -0,0 +1,121 @@
+import os
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm.attributes import set_committed_value
+
+from tr.models import POST_DUE_STATES, POST_UPLOADING, Post
+
+
+def worker_name(worker) -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{worker}"[:64]
+
+
+def claimable(now):
+    # an unclaimed post left uploading was sent without that being recorded; see abandon_upload()
+    return and_(Post.due(now),
+                or_(and_(Post.claimed_by.is_(None), Post.state != POST_UPLOADING), Post.lease_expires < now))
+
+
+def claim_posts(session, owner, limit, lease_time, after_id=0) -> list:
+    """
+    Lease up to `limit` due posts to `owner` and return their ids.
+
+    Posts claimed by another worker are skipped until that worker's lease
+    runs out, so several workers can drain the queue without sending the
+    same post twice, and a crashed worker's posts are picked up again once
+    its lease expires. `after_id` lets a caller walk the queue forward
+    without reclaiming posts it has already tried.
+    """
+
+    now = datetime.now()
+    expires = now + timedelta(seconds=lease_time)
+    values = {Post.claimed_by: owner, Post.lease_expires: expires}
+
+    candidates = session.query(Post.id).filter(claimable(now), Post.id > after_id).order_by(Post.id).limit(limit)
+
+    if session.bind.dialect.name == 'mysql':
+        # rows locked by a concurrent claim are skipped rather than waited on
+        ids = [row.id for row in candidates.with_for_update(skip_locked=True)]
+
+        if ids:
+            session.query(Post).filter(Post.id.in_(ids)).update(values, synchronize_session=False)
+
+    else:
+        # SQLite has no row locks, but a single UPDATE is atomic, and
+        # re-checking claimable() inside it makes it a compare-and-set
+        subquery = candidates.subquery()
+        session.query(Post).filter(Post.id.in_(select([subquery.c.id])), claimable(now)) \
+            .update(values, synchronize_session=False)
+
+        ids = [row.id for row in session.query(Post.id)
+                                        .filter(Post.claimed_by == owner, Post.lease_expires == expires)
+                                        .order_by(Post.id)]
+
+    session.commit()
+
+    return ids
+
+
+def start_upload(session, owner, post, lease_time) -> bool:
+    """
+    Move `post` to uploading and renew its lease, but only if `owner` still
+    holds it. A lease can run out while a worker works through its batch and
+    another worker may have claimed the post since, so this is a single
+    compare-and-set UPDATE; False means the post is no longer ours to send.
+    """
+
+    expires = datetime.now() + timedelta(seconds=lease_time)
+    attempts = (post.attempts or 0) + 1
+
+    updated = session.query(Post) \
+                     .filter(Post.id == post.id, Post.claimed_by == owner, Post.state.in_(POST_DUE_STATES)) \
+                     .update({Post.state: POST_UPLOADING, Post.attempts: Post.attempts + 1,
+                              Post.lease_expires: expires}, synchronize_session=False)
+    session.commit()
+
+    if not updated:
+        session.expire(post)
+        return False
+
+    set_committed_value(post, 'state', POST_UPLOADING)
+    set_committed_value(post, 'attempts', attempts)
+    set_committed_value(post, 'lease_expires', expires)
+
+    return True
+
+
+def abandon_upload(session, owner, post_id) -> None:
+    """
+    Give up `owner`'s claim on a post that went out but couldn't be marked
+    posted, leaving it uploading. Such a post is never claimed again, so it
+    isn't sent twice; its status id is in the worker's log.
+    """
+
+    session.query(Post) \
+           .filter(Post.id == post_id, Post.claimed_by == owner, Post.state == POST_UPLOADING) \
+           .update({Post.claimed_by: None, Post.lease_expires: None}, synchronize_session=False)
+    session.commit()
+
+
+def release_posts(session, owner, post_ids) -> None:
+    """ Give up `owner`'s claims on whichever of `post_ids` it hasn't started uploading """
+
+    session.query(Post) \
+           .filter(Post.id.in_(post_ids), Post.claimed_by == owner, Post.state != POST_UPLOADING) \
+           .update({Post.claimed_by: None, Post.lease_expires: None}, synchronize_session=False)
+    session.commit()
+
+
+def release_post(session, owner, post) -> None:
+    """
+    Give up `owner`'s claim on `post`. A post still marked uploading may
+    have gone out without that being recorded, so it keeps its lease and is
+    only picked up again once the lease has run out.
+    """
+
+    if post.claimed_by == owner and post.state != POST_UPLOADING:
+        post.claimed_by = None
+        post.lease_expires = None
+    session.commit()
@@ -0,0 +1,96 @@
+import logging
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+
+from tr.models import OutboxMail
+
+l = logging.getLogger('mail_outbox')
+
+NEW_POST = 'new_post'
+NEW_USER = 'new_user'
+
+
+def enqueue(session, kind, subject, body, recipient) -> OutboxMail:
+    """ Queue a mail; it goes out with the caller's commit and is sent by the worker """
+
+    mail = OutboxMail(kind=kind, subject=subject, body=body, recipient=recipient)
+    session.add(mail)
+    return mail
+
+
+def digest_ready(rows, interval, now=None) -> bool:
+    """ A digest goes out once its oldest mail has waited `interval` seconds """
+
+    now = now or datetime.utcnow()
+    return bool(rows) and min(row.created for row in rows) <= now - timedelta(seconds=interval)
+
+
+def digest_message(rows) -> tuple:
+    subject = f"{len(rows)} new posts" if len(rows) > 1 else rows[0].subject
+    body = "\n\n----------\n\n".join(row.body.strip() for row in rows) + "\n"
+    return subject, body
+
+
+def send_pending(session, mail, config) -> int:
+    """
+    Send every due mail over one SMTP connection and delete what was sent.
+    With MAIL_DIGEST set, new post notifications are held until the oldest
+    is MAIL_DIGEST_INTERVAL seconds old and then sent as a single message
+    per recipient. Returns the number of mails taken off the queue.
+    """
+
+    rows = session.query(OutboxMail) \
+                  .filter(OutboxMail.due(config.get('MAIL_MAX_ATTEMPTS', 8))) \
+                  .order_by(OutboxMail.id) \
+                  .limit(config.get('MAIL_BATCH', 100)).all()
+
+    if not rows:
+        return 0
+
+    messages = []
+    singles = rows
+
+    if config.get('MAIL_DIGEST'):
+        singles = [row for row in rows if row.kind != NEW_POST]
+        digests = {}
+
+        for row in rows:
+            if row.kind == NEW_POST:
+                digests.setdefault(row.recipient, []).append(row)
+
+        for recipient, digest in digests.items():
+            if digest_ready(digest, config.get('MAIL_DIGEST_INTERVAL', 3600)):
+                subject, body = digest_message(digest)
+                messages.append((digest, Message(subject=subject, body=body, recipients=[recipient])))
+
+    for row in singles:
+        messages.append(([row], Message(subject=row.subject, body=row.body, recipients=[row.recipient])))
+
+    if not messages:
+        # only digests that aren't due yet; don't log in to the SMTP server for nothing
+        return 0
+
+    sent = 0
+
+    try:
+        with mail.connect() as conn:
+            for batch, message in messages:
+                conn.send(message)
+
+                for row in batch:
+                    session.delete(row)
+
+                sent += len(batch)
+
+    except Exception as e:
+        l.error(e)
+
+        for batch, message in messages:
+            for row in batch:
+                if row not in session.deleted:
+                    row.failed(e, config.get('MAIL_RETRY_TIME', 60))
+
+    session.commit()
+
+    return sent
@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+
+import requests
+from mastodon import Mastodon
+from requests.adapters import HTTPAdapter
+
+UNKNOWN_VERSION = '1.0.0'
+
+
+class MastodonClients(object):
+    """
+    Mastodon API objects cached by (instance, access token).
+
+    Every instance gets one pooled requests.Session shared by all clients
+    that talk to it, and its version is looked up once rather than by each
+    new Mastodon() (which otherwise costs a GET /api/v1/instance apiece).
+    When an owner's token changes the client for the old token is dropped.
+
+    Clients without a token are never cached: log_in() stores the token it
+    receives on the object, so one would end up carrying a user's credentials.
+    """
+
+    def __init__(self, maxsize=256, request_timeout=10, pool_maxsize=4, ratelimit_method='wait'):
+        self.maxsize = maxsize
+        self.request_timeout = request_timeout
+        self.ratelimit_method = ratelimit_method
+        self.pool_maxsize = pool_maxsize
+
+        self._clients = OrderedDict()
+        self._sessions = {}
+        self._versions = {}
+        self._tokens = {}
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def session_for(self, api_base_url) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(api_base_url)
+
+            if session is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[api_base_url] = session
+
+            return session
+
+    def get(self, api_base_url, client_id=None, client_secret=None, access_token=None, owner=None) -> Mastodon:
+        key = (api_base_url, access_token)
+
+        with self._lock:
+            if owner is not None:
+                old_token = self._tokens.get((api_base_url, owner))
+
+                if old_token is not None and old_token != access_token:
+                    self._clients.pop((api_base_url, old_token), None)
+
+                self._tokens[(api_base_url, owner)] = access_token
+
+            api = self._clients.get(key)
+
+            if api is not None and api.client_id == client_id and api.access_token == access_token:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return api
+
+            self.misses += 1
+            version = self._versions.get(api_base_url)
+
+        api = Mastodon(
+                client_id=client_id,
+                client_secret=client_secret,
+                api_base_url=api_base_url,
+                access_token=access_token,
+                debug_requests=False,
+                request_timeout=self.request_timeout,
+                ratelimit_method=self.ratelimit_method,
+                mastodon_version=version or UNKNOWN_VERSION
+        )
+        api.session = self.session_for(api_base_url)
+
+        if version is None:
+            version = api.retrieve_mastodon_version()
+
+        with self._lock:
+            if version != UNKNOWN_VERSION:
+                self._versions[api_base_url] = version
+
+            if access_token is None:
+                return api
+
+            self._clients[key] = api
+
+            while len(self._clients) > self.maxsize:
+                self._clients.popitem(last=False)
+
+        return api
+
+    def evict(self, api_base_url, access_token=None) -> None:
+        with self._lock:
+            self._clients.pop((api_base_url, access_token), None)
+
+    def stats(self) -> dict:
+        return {
+            'clients': len(self._clients),
+            'hosts': len(self._sessions),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+clients = MastodonClients()
+
+
+def configure(config, ratelimit_method='wait') -> MastodonClients:
+    """ The worker passes ratelimit_method='throw' so its scheduler, not Mastodon.py, waits out 429s """
+    global clients
+
+    clients = MastodonClients(maxsize=config.get('MASTODON_CLIENT_CACHE_SIZE', 256),
+                              request_timeout=config.get('MASTODON_REQUEST_TIMEOUT', 10),
+                              pool_maxsize=config.get('WORKER_HOST_CONCURRENCY', 2) + 2,
+                              ratelimit_method=ratelimit_method)
+
+    return clients
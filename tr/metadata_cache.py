@@ -0,0 +1,199 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy import exc
+
+from tr import metrics
+
+TRACKING_PARAMS = {'fbclid', 'gclid', 'igshid', 'si', 'ref', 'ref_src', 'feature'}
+
+
+def canonical_url(url) -> str:
+    """
+    Normalize a share link so trivially different copies of the same link
+    (case, fragments, tracking parameters, trailing slashes) share a key.
+    """
+
+    parts = urlsplit(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in TRACKING_PARAMS and not k.startswith('utm_'))
+    path = parts.path.rstrip('/') or '/'
+
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ''))
+
+
+def cache_key(url) -> str:
+    return hashlib.sha1(canonical_url(url).encode('utf-8')).hexdigest()
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                return None
+
+            expires, value = item
+
+            if expires < time.time():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MetadataCache(object):
+    """
+    Resolved link metadata (title, album art, canonical share link) keyed
+    by the normalized share link. Lookups go to an in-process LRU first and
+    then, if an engine is configured, to the link_metadata table.
+    """
+
+    def __init__(self, maxsize=1024, ttl=7 * 24 * 3600, engine=None):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.engine = engine
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @property
+    def table(self):
+        # imported here because tr.models consults this cache
+        from tr.models import LinkMetadata
+        return LinkMetadata.__table__
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+        metrics.CACHE_LOOKUPS.inc(cache='metadata', result={'hits': 'hit', 'db_hits': 'db_hit'}.get(name, 'miss'))
+
+    def get(self, url):
+        key = cache_key(url)
+        value = self.memory.get(key)
+
+        if value is not None:
+            self._count('hits')
+            return value
+
+        if self.engine is not None:
+            value = self._db_get(key)
+
+            if value is not None:
+                self.memory.set(key, value)
+                self._count('db_hits')
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, url, value) -> None:
+        key = cache_key(url)
+        self.memory.set(key, value)
+
+        if self.engine is not None:
+            self._db_set(key, url, value)
+
+    def _db_get(self, key):
+        t = self.table
+        oldest = datetime.utcnow() - timedelta(seconds=self.ttl)
+
+        try:
+            row = self.engine.execute(
+                    t.select().where(t.c.url_hash == key).where(t.c.fetched >= oldest)
+            ).first()
+        except exc.SQLAlchemyError:
+            return None
+
+        if not row:
+            return None
+
+        return {'share_link': row.share_link, 'title': row.title, 'album_art': row.album_art}
+
+    def _db_set(self, key, url, value) -> None:
+        t = self.table
+        values = {
+            'url': canonical_url(url)[:400],
+            'share_link': value['share_link'],
+            'title': value['title'],
+            'album_art': value['album_art'],
+            'fetched': datetime.utcnow(),
+        }
+
+        try:
+            with self.engine.begin() as conn:
+                updated = conn.execute(t.update().where(t.c.url_hash == key).values(**values))
+
+                if not updated.rowcount:
+                    conn.execute(t.insert().values(url_hash=key, **values))
+        except exc.SQLAlchemyError:
+            pass
+
+    def purge(self) -> int:
+        if self.engine is None:
+            return 0
+
+        oldest = datetime.utcnow() - timedelta(seconds=self.ttl)
+        result = self.engine.execute(self.table.delete().where(self.table.c.fetched < oldest))
+
+        return result.rowcount
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.db_hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.db_hits) / lookups if lookups else 0.0,
+            'size': len(self.memory),
+            'evictions': self.memory.evictions,
+        }
+
+
+cache = MetadataCache()
+
+
+def configure(config, engine=None) -> MetadataCache:
+    global cache
+
+    if not config.get('METADATA_CACHE_DB', True):
+        engine = None
+
+    cache = MetadataCache(maxsize=config.get('METADATA_CACHE_SIZE', 1024),
+                          ttl=config.get('METADATA_CACHE_TTL', 7 * 24 * 3600),
+                          engine=engine)
+
+    return cache
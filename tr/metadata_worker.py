@@ -0,0 +1,127 @@
+import argparse
+import logging
+import os
+from datetime import datetime
+
+from flask import Config
+from sqlalchemy.orm import Session
+
+from tr import feed_cache, http_client, metadata_cache, metrics
+from tr.db import create_db_engine
+from tr.models import Post
+from tr.queries import iter_batches
+
+FORMAT = "%(asctime)-15s [%(filename)s:%(lineno)s : %(funcName)s()] %(message)s"
+
+logging.basicConfig(format=FORMAT)
+
+l = logging.getLogger('metadata_worker')
+
+
+def queued_posts(session):
+    return session.query(Post).filter(Post.metadata_queued.is_(True), Post.metadata_due())
+
+
+def backfill_posts(session):
+    return session.query(Post).filter(Post.title.is_(None), Post.album_art.is_(None), Post.metadata_due())
+
+
+def report(session) -> None:
+    missing = session.query(Post).filter(Post.title.is_(None), Post.album_art.is_(None))
+    waiting = missing.filter(Post.metadata_retry_at > datetime.now())
+    stuck = session.query(Post).filter(Post.metadata_stuck())
+
+    l.info(f"Posts without metadata: {missing.count()}")
+    l.info(f"Waiting to retry: {waiting.count()}")
+    l.info(f"Given up on: {stuck.count()}")
+
+    for post in stuck.order_by(Post.id):
+        l.info(f"  {post.id} {post.share_link} ({post.metadata_attempts} attempts): {post.metadata_error}")
+
+
+def enrich_posts(session, query, batch_size=50) -> int:
+    """
+    Walk `query` in id order one batch at a time, fetching metadata for each
+    post and committing once per batch. The feed cache is invalidated after
+    any batch that gave a post a title or album art.
+    """
+
+    count = 0
+
+    for batch in iter_batches(session, query, batch_size):
+        changed = False
+
+        for post in batch:
+            l.info(f"Fetching metadata for post {post.id}: {post.share_link}")
+            before = (post.title, post.album_art)
+
+            try:
+                post.enrich_metadata()
+            except Exception as e:
+                l.error(e)
+                post.metadata_failed(e)
+
+            if post.metadata_error and not post.title:
+                l.warning(f"Post {post.id} attempt {post.metadata_attempts}: {post.metadata_error}")
+
+            changed = changed or (post.title, post.album_art) != before
+            count += 1
+
+        session.commit()
+
+        if changed:
+            feed_cache.cache.invalidate()
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Metadata Worker')
+    parser.add_argument('--backfill', action='store_true',
+                        help='enrich every post that has no title or album art, not just queued ones')
+    parser.add_argument('--report', action='store_true',
+                        help='list posts whose metadata lookups are failing and exit')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=50)
+    args = parser.parse_args()
+
+    config = os.environ.get('TR_CONFIG', 'DevelopmentConfig')
+    c = Config(os.getcwd())
+    c.from_object('config.' + config)
+
+    if c['DEBUG']:
+        l.setLevel(logging.DEBUG)
+    else:
+        l.setLevel(logging.INFO)
+
+    http_client.configure(c)
+    feed_cache.configure(c)
+
+    engine = create_db_engine(c)
+    metrics.instrument_engine(engine)
+    session = Session(engine)
+    metadata_cache.configure(c, engine)
+
+    if args.report:
+        report(session)
+        session.close()
+        return
+
+    if args.backfill:
+        l.info(f"Purged {metadata_cache.cache.purge()} expired cache entries")
+        query = backfill_posts(session)
+    else:
+        query = queued_posts(session)
+
+    count = enrich_posts(session, query, args.batch_size)
+
+    l.info(f"HTTP: {http_client.client.stats()}")
+    l.info(f"Metadata cache: {metadata_cache.cache.stats()}")
+    l.info(f"-- Enriched {count} posts")
+    session.close()
+
+    if c.get('METRICS_METADATA_TEXTFILE'):
+        metrics.REGISTRY.write_textfile(c['METRICS_METADATA_TEXTFILE'])
+
+
+if __name__ == '__main__':
+    main()
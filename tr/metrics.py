@@ -0,0 +1,251 @@
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import event
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+STAGE_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric(object):
+    """
+    One metric family in the Prometheus text format. Values are kept per
+    combination of label values; a metric without labels starts at zero so
+    it is always exported.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+        if not self.labelnames:
+            self._values[()] = self._initial()
+
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self, key, value) -> list:
+        return [(self.name, _labels(self.labelnames, key), value)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values = {(): self._initial()} if not self.labelnames else {}
+
+    def render(self) -> str:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        if not values:
+            return ''
+
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+        for key, value in values:
+            lines.extend(f'{name}{labels} {_number(v)}' for name, labels, v in self._samples(key, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _initial(self):
+        # per-bucket counts (not cumulative), then the sum of all observations
+        return [0] * len(self.buckets) + [0.0]
+
+    def observe(self, value, **labels) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            counts = self._values.get(key)
+
+            if counts is None:
+                counts = self._values[key] = self._initial()
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, key, value) -> list:
+        samples = []
+        cumulative = 0
+
+        for bound, count in zip(self.buckets, value):
+            cumulative += count
+            samples.append((self.name + '_bucket', _labels(self.labelnames, key, [('le', _number(bound))]),
+                            cumulative))
+
+        labels = _labels(self.labelnames, key)
+        samples.append((self.name + '_count', labels, cumulative))
+        samples.append((self.name + '_sum', labels, value[-1]))
+
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return ''.join(metric.render() for metric in self.metrics)
+
+    def write_textfile(self, path) -> None:
+        """ Write everything for node_exporter's textfile collector, replacing the file in one step """
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=str(path.parent), suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, str(path))
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+
+REGISTRY = Registry()
+
+# web
+REQUEST_SECONDS = Histogram('tr_http_request_duration_seconds', 'Time spent handling a request.',
+                            ['route', 'method', 'status'])
+
+# database
+DB_QUERY_SECONDS = Histogram('tr_db_query_duration_seconds', 'Time spent in each SQL statement.',
+                             buckets=QUERY_BUCKETS)
+
+# metadata and caches
+METADATA_FETCH_SECONDS = Histogram('tr_metadata_fetch_duration_seconds', 'Time spent resolving a share link.',
+                                   ['provider', 'outcome'], buckets=STAGE_BUCKETS)
+CACHE_LOOKUPS = Counter('tr_cache_lookups_total', 'Cache lookups by cache and result.', ['cache', 'result'])
+
+# worker
+STAGE_SECONDS = Histogram('tr_worker_stage_duration_seconds', 'Time spent in each posting stage per host.',
+                          ['stage', 'host'], buckets=STAGE_BUCKETS)
+STAGE_FAILURES = Counter('tr_worker_stage_failures_total', 'Posting stages that raised, per host.',
+                         ['stage', 'host'])
+WORKER_ITEMS = Counter('tr_worker_items_total', 'Posts, reblogs and mails handled by the worker.',
+                       ['kind', 'outcome'])
+
+# queues, read from the database when the app is scraped
+QUEUE_DEPTH = Gauge('tr_queue_depth', 'Items waiting in each queue.', ['queue'])
+QUEUE_OLDEST_SECONDS = Gauge('tr_queue_oldest_age_seconds', 'Age of the oldest item waiting in each queue.',
+                             ['queue'])
+
+
+@contextmanager
+def stage(name, host):
+    """ Time one worker stage against `host`, counting it as failed if it raises """
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=name, host=host)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name, host=host)
+
+
+def instrument_engine(engine) -> None:
+    """ Time every statement `engine` runs into DB_QUERY_SECONDS """
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - conn.info['metrics_query_start'].pop())
+
+    def handle_error(context):
+        starts = context.connection.info.get('metrics_query_start') if context.connection else None
+
+        if starts:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - starts.pop())
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
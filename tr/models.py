@@ -1,19 +1,52 @@
 import math
+import time
 import pprint as pp
 import re
 from datetime import datetime, timedelta
 import requests
 from flask import render_template
-from metadata_parser import MetadataParser
-from requests import Request
-from sqlalchemy import BigInteger, Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String
+from markupsafe import Markup, escape
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Text, and_, or_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from tr import metadata_cache, metrics, providers
+
 metadata = MetaData()
 Base = declarative_base(metadata=metadata)
 
-PENALTY_TIME = 600  # 10 minutes
+METADATA_RETRY_TIME = 300  # 5 minutes, doubled after every failed lookup
+METADATA_MAX_ATTEMPTS = 8
+
+_paragraph_re = re.compile(r'(?:\r\n|\r|\n){2,}')
+
+POST_PENDING = 'pending'
+POST_UPLOADING = 'uploading'
+POST_POSTED = 'posted'
+POST_FAILED = 'failed'
+POST_DEAD = 'dead'
+
+# states the worker picks up; an `uploading` post is only claimable again once its lease has run out
+POST_DUE_STATES = (POST_PENDING, POST_FAILED, POST_UPLOADING)
+
+
+def fit_metadata(resolved, share_link) -> dict:
+    """
+    Resolved link metadata cut to fit the posts and link_metadata columns,
+    so what is cached is exactly what a post stores. Titles are truncated;
+    links too long to store are dropped rather than cut, keeping the post's
+    own `share_link`.
+    """
+
+    title = resolved.get('title')
+    album_art = resolved.get('album_art')
+    canonical = resolved.get('share_link')
+
+    return {
+        'share_link': canonical if canonical and len(canonical) <= 400 else share_link,
+        'title': title.strip()[:100] if title else None,
+        'album_art': album_art if album_art and len(album_art) <= 200 else None,
+    }
 
 
 class Settings(Base):
@@ -26,7 +59,10 @@ class Settings(Base):
 
 class MastodonHost(Base):
     __tablename__ = 'mastodon_host'
-    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'}
+    __table_args__ = (
+        Index('uq_mastodon_host_hostname', 'hostname', unique=True),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'},
+    )
 
     id = Column(Integer, primary_key=True)
     hostname = Column(String(80), nullable=False)
@@ -36,13 +72,29 @@ class MastodonHost(Base):
     users = relationship('User', backref='mastodon_host', lazy='dynamic')
     defer_until = Column(DateTime)
 
-    def defer(self):
-        self.defer_until = datetime.now() + timedelta(seconds=PENALTY_TIME)
+    def defer(self, seconds):
+        self.defer_until = datetime.now() + timedelta(seconds=seconds)
+
+
+class LinkMetadata(Base):
+    __tablename__ = 'link_metadata'
+    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'}
+
+    url_hash = Column(String(40), primary_key=True)
+    url = Column(String(400), nullable=False)
+    share_link = Column(String(400), nullable=False)
+    title = Column(String(100), nullable=True)
+    album_art = Column(String(200), nullable=True)
+    fetched = Column(DateTime, nullable=False, default=datetime.utcnow)
 
 
 class Post(Base):
     __tablename__ = 'posts'
-    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'}
+    __table_args__ = (
+        Index('ix_posts_posted_updated_id', 'posted', 'updated', 'id'),
+        Index('ix_posts_state_next_attempt_at', 'state', 'next_attempt_at'),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'},
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
 
@@ -54,70 +106,173 @@ class Post(Base):
     posted = Column(Boolean, nullable=False, default=False)
     toot_visibility = Column(String(40), nullable=True)
     status_id = Column(BigInteger, default=0)
+    metadata_queued = Column(Boolean, nullable=False, default=False)
+    metadata_attempts = Column(Integer, nullable=False, default=0)
+    metadata_error = Column(String(200), nullable=True)
+    metadata_retry_at = Column(DateTime, nullable=True)
+    claimed_by = Column(String(64), nullable=True)
+    lease_expires = Column(DateTime, nullable=True)
+    state = Column(String(16), nullable=False, default=POST_PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(200), nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)
+
+    # what the feed shows, worked out once when the post goes out
+    comment_html = Column(Text, nullable=True)
+    song_url = Column(String(400), nullable=True)
+    status_url = Column(String(400), nullable=True)
 
     created = Column(DateTime, default=datetime.utcnow)
     updated = Column(DateTime)
 
+    reblogs = relationship('Reblog', backref='post', cascade='all, delete-orphan')
+
     md = None
 
+    @property
+    def provider(self):
+        return providers.registry.match(self.share_link)
+
     @property
     def share_link_is_song_link(self):
-        pattern = re.compile("^https://song.link/")
-        if pattern.search(self.share_link):
-            return True
-        else:
-            return False
+        return self.provider.name == 'songlink'
 
     @property
     def share_link_is_bandcamp(self):
-        pattern = re.compile("^https://.*bandcamp.com/")
-        if pattern.search(self.share_link):
-            return True
-        else:
-            return False
+        return self.provider.name == 'bandcamp'
 
     @property
     def share_link_is_soundcloud(self):
-        pattern = re.compile("^https://soundcloud.com/")
-        if pattern.search(self.share_link):
-            return True
-        else:
-            return False
+        return self.provider.name == 'soundcloud'
 
     @property
     def song_link(self):
-        if self.share_link_is_song_link:
-            return self.share_link
-        elif self.share_link_is_bandcamp:
-            return self.share_link
-        elif self.share_link_is_soundcloud:
-            return self.share_link
+        return self.provider.link(self.share_link)
+
+    @classmethod
+    def metadata_due(cls, now=None):
+        now = now or datetime.now()
+
+        return and_(cls.metadata_attempts < METADATA_MAX_ATTEMPTS,
+                    or_(cls.metadata_retry_at.is_(None), cls.metadata_retry_at <= now))
+
+    @classmethod
+    def metadata_stuck(cls):
+        return and_(cls.title.is_(None),
+                    cls.album_art.is_(None),
+                    cls.metadata_attempts >= METADATA_MAX_ATTEMPTS)
+
+    @property
+    def metadata_retryable(self) -> bool:
+        return (self.metadata_attempts or 0) < METADATA_MAX_ATTEMPTS
+
+    def metadata_failed(self, error) -> None:
+        self.metadata_attempts = (self.metadata_attempts or 0) + 1
+        self.metadata_error = str(error)[:200]
+
+        if self.metadata_retryable:
+            delay = METADATA_RETRY_TIME * 2 ** (self.metadata_attempts - 1)
+            self.metadata_retry_at = datetime.now() + timedelta(seconds=delay)
         else:
-            return f"https://song.link/{self.share_link}"
+            self.metadata_retry_at = None
 
     def fetch_metadata(self) -> None:
 
         if self.album_art or self.title:
             return
 
+        if not self.metadata_retryable:
+            return
+
+        if self.metadata_retry_at and self.metadata_retry_at > datetime.now():
+            return
+
+        cached = metadata_cache.cache.get(self.song_link)
+
+        if cached:
+            cached = fit_metadata(cached, self.share_link)
+            self.share_link = cached['share_link']
+            self.title = cached['title']
+            self.album_art = cached['album_art']
+            return
+
         if not self.md:
-            req = Request('GET', self.song_link, headers={'User-Agent': 'curl/7.54.0'})
-            prepped = req.prepare()
-            s = requests.Session()
-            r = s.send(prepped)
+            provider = self.provider
+            song_link = provider.link(self.share_link)
+            start = time.perf_counter()
+
+            try:
+                resolved = provider.resolve(song_link)
+            except (providers.ResolveError, requests.RequestException) as e:
+                metrics.METADATA_FETCH_SECONDS.observe(time.perf_counter() - start, provider=provider.name,
+                                                       outcome='error')
+                self.metadata_failed(e)
+                return
+
+            metrics.METADATA_FETCH_SECONDS.observe(time.perf_counter() - start, provider=provider.name,
+                                                   outcome='ok')
+
+            resolved = fit_metadata(resolved, self.share_link)
+
+            self.md = resolved
+            self.share_link = resolved['share_link']
+            self.title = resolved['title']
+            self.album_art = resolved['album_art']
+            self.metadata_error = None
+            self.metadata_retry_at = None
+
+            metadata_cache.cache.set(song_link, resolved)
+            metadata_cache.cache.set(self.share_link, resolved)
+
+    def enrich_metadata(self) -> None:
+        self.fetch_metadata()
+
+        if self.title or self.album_art or not self.metadata_retryable:
+            self.metadata_queued = False
+
+    @classmethod
+    def due(cls, now=None):
+        now = now or datetime.now()
+
+        return and_(cls.state.in_(POST_DUE_STATES),
+                    or_(cls.next_attempt_at.is_(None), cls.next_attempt_at <= now))
+
+    def mark_posted(self, status_id) -> None:
+        self.state = POST_POSTED
+        self.posted = True
+        self.status_id = status_id
+        self.updated = datetime.now()
+        self.last_error = None
+        self.next_attempt_at = None
+
+        self.comment_html = nl2br(self.comment)
+        self.song_url = self.song_link
+        self.status_url = self.post_link
+
+    def attempt_failed(self, error, max_attempts, retry_time) -> None:
+        """ Retry later with exponential backoff, or give up once `max_attempts` have been used """
+
+        self.last_error = str(error)[:200]
+
+        if (self.attempts or 0) >= max_attempts:
+            self.state = POST_DEAD
+            self.next_attempt_at = None
+        else:
+            self.state = POST_FAILED
+            delay = retry_time * 2 ** max((self.attempts or 1) - 1, 0)
+            self.next_attempt_at = datetime.now() + timedelta(seconds=delay)
 
-            if r.status_code == 200:
-                self.share_link = r.url
+    def retry_in(self, seconds, reason=None) -> None:
+        """ Put the post back without using up an attempt, e.g. while its host is backed off """
 
-                mp = MetadataParser(html=r.text, search_head_only=True)
-                self.md = mp.metadata
-                self.title = self.md['og']['title']
-                image_link = self.md['og']['image']
+        if self.state == POST_UPLOADING:
+            self.attempts = max((self.attempts or 0) - 1, 0)
+            self.state = POST_FAILED if self.attempts else POST_PENDING
 
-                if image_link[0:5] == 'http:':
-                    image_link = 'https:' + image_link[5:]
+        if reason:
+            self.last_error = str(reason)[:200]
 
-                self.album_art = image_link
+        self.next_attempt_at = datetime.now() + timedelta(seconds=seconds)
 
     @property
     def post_link(self):
@@ -132,9 +287,71 @@ class Post(Base):
         return reltime(self.created)
 
 
+class OutboxRow(object):
+    """ Retry bookkeeping for outbox rows with `attempts`, `last_error` and `next_attempt_at` columns """
+
+    @classmethod
+    def due(cls, max_attempts, now=None):
+        now = now or datetime.now()
+
+        return and_(cls.attempts < max_attempts,
+                    or_(cls.next_attempt_at.is_(None), cls.next_attempt_at <= now))
+
+    def failed(self, error, retry_time) -> None:
+        self.attempts = (self.attempts or 0) + 1
+        self.last_error = str(error)[:200]
+        self.next_attempt_at = datetime.now() + timedelta(seconds=retry_time * 2 ** (self.attempts - 1))
+
+
+class Reblog(OutboxRow, Base):
+    """
+    A sent post waiting to be boosted by the curator account. Rows are added
+    in the same commit that marks the post sent and deleted once the boost
+    succeeds, so a slow or failing curator instance never holds up posting.
+    """
+
+    __tablename__ = 'reblogs'
+    __table_args__ = (
+        Index('ix_reblogs_next_attempt_at', 'next_attempt_at'),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'},
+    )
+
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey('posts.id'), nullable=False)
+    status_id = Column(BigInteger, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(200), nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)
+    created = Column(DateTime, default=datetime.utcnow)
+
+
+class OutboxMail(OutboxRow, Base):
+    """ A notification email waiting for tr.mail_outbox to send it """
+
+    __tablename__ = 'mail_outbox'
+    __table_args__ = (
+        Index('ix_mail_outbox_next_attempt_at', 'next_attempt_at'),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'},
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(32), nullable=False)
+    subject = Column(String(200), nullable=False)
+    body = Column(Text, nullable=False)
+    recipient = Column(String(200), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(200), nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)
+    created = Column(DateTime, default=datetime.utcnow)
+
+
 class User(Base):
     __tablename__ = 'users'
-    __table_args__ = {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'}
+    __table_args__ = (
+        Index('ix_users_mastodon_account_id_host', 'mastodon_account_id', 'mastodon_host_id'),
+        Index('uq_users_mastodon_user_host', 'mastodon_user', 'mastodon_host_id', unique=True),
+        {'mysql_charset': 'utf8mb4', 'mysql_collate': 'utf8mb4_general_ci'},
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -155,20 +372,28 @@ class User(Base):
         return url
 
 
+def nl2br(value) -> Markup:
+    """ Escape `value` and turn its blank lines into paragraphs and its line breaks into <br> """
+
+    return Markup(u'\n\n'.join(u'<p>%s</p>' % p.replace('\n', Markup('<br>\n'))
+                                 for p in _paragraph_re.split(escape(value))))
+
+
+def ordinal(n):
+    r"""Returns a string ordinal representation of a number
+    Taken from: http://stackoverflow.com/a/739301/180718
+    """
+    if 10 <= n % 100 < 20:
+        return str(n) + 'th'
+    else:
+        return str(n) + {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, "th")
+
+
 def reltime(date, compare_to=None, at='@') -> str:
     """
     Modified From https://gist.githubusercontent.com/deontologician/3503910/raw/bf46f646d79bd6d3cb29fcf23be5a72a6a92c185/reltime.py
     """
 
-    def ordinal(n):
-        r"""Returns a string ordinal representation of a number
-        Taken from: http://stackoverflow.com/a/739301/180718
-        """
-        if 10 <= n % 100 < 20:
-            return str(n) + 'th'
-        else:
-            return str(n) + {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, "th")
-
     compare_to = compare_to or datetime.utcnow()
     if date > compare_to:
         raise NotImplementedError('reltime only handles dates in the past')
@@ -0,0 +1,98 @@
+import codecs
+from html.parser import HTMLParser
+
+from tr import http_client
+
+MAX_HEAD_BYTES = 512 * 1024
+
+
+class OpenGraphParser(HTMLParser):
+    """
+    Incremental parser that only collects `<meta property="og:...">` tags and
+    reports `done` as soon as the document head is over, so callers can stop
+    reading the page there.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.og = {}
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        if tag == 'body':
+            self.done = True
+
+        elif tag == 'meta':
+            attrs = dict(attrs)
+            prop = attrs.get('property') or attrs.get('name') or ''
+
+            if prop.startswith('og:') and attrs.get('content') is not None:
+                # keep the first value, like MetadataParser does for repeated tags
+                self.og.setdefault(prop[3:], attrs['content'])
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.done = True
+
+
+class HeadResult(object):
+    def __init__(self, url, status_code, og, bytes_read):
+        self.url = url
+        self.status_code = status_code
+        self.og = og
+        self.bytes_read = bytes_read
+
+
+def parse_og(chunks, encoding='utf-8'):
+    """
+    Feed byte chunks to an OpenGraphParser until the head is over. Returns
+    the og properties and the number of bytes consumed.
+    """
+
+    parser = OpenGraphParser()
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    bytes_read = 0
+
+    for chunk in chunks:
+        bytes_read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+
+        if parser.done:
+            break
+
+    return parser.og, bytes_read
+
+
+def fetch_head(url, max_bytes=MAX_HEAD_BYTES) -> HeadResult:
+    """
+    GET `url` but read no further than the end of `<head>` (or `max_bytes`)
+    and extract its og: tags on the way.
+    """
+
+    client = http_client.client
+    r = client.get(url, stream=True)
+
+    try:
+        if r.status_code != 200:
+            return HeadResult(r.url, r.status_code, {}, 0)
+
+        encoding = r.encoding if r.encoding and 'charset' in r.headers.get('Content-Type', '') else 'utf-8'
+
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            encoding = 'utf-8'
+
+        chunks = client.iter_content(r, chunk_size=8 * 1024, max_bytes=max_bytes, truncate=True)
+        og, bytes_read = parse_og(chunks, encoding)
+
+    finally:
+        r.close()
+
+    return HeadResult(r.url, r.status_code, og, bytes_read)
+
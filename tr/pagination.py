@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, or_
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+OLDER = 'older'
+NEWER = 'newer'
+
+
+class FeedPage(object):
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+
+class CursorCodec(object):
+    """
+    Encodes an (updated, id) position in the feed as an opaque, signed token
+    so cursors survive round trips through the query string unchanged.
+    """
+
+    def __init__(self, secret_key, salt='feed-cursor'):
+        self.serializer = URLSafeSerializer(secret_key, salt=salt)
+
+    def encode(self, updated, post_id) -> str:
+        return self.serializer.dumps([updated.strftime(CURSOR_DATE_FORMAT), post_id])
+
+    def decode(self, token):
+        try:
+            updated, post_id = self.serializer.loads(token)
+            return datetime.strptime(updated, CURSOR_DATE_FORMAT), int(post_id)
+        except (BadSignature, ValueError, TypeError):
+            return None
+
+
+def keyset_query(query, updated_col, id_col, page_size, position=None, direction=OLDER):
+    """ The rows of one page after (or, going NEWER, before) `position`, plus one to tell if there are more """
+
+    if position and direction == NEWER:
+        updated, post_id = position
+        query = query.filter(or_(updated_col > updated,
+                                 and_(updated_col == updated, id_col > post_id)))
+        return query.order_by(updated_col.asc(), id_col.asc()).limit(page_size + 1)
+
+    if position:
+        updated, post_id = position
+        query = query.filter(or_(updated_col < updated,
+                                 and_(updated_col == updated, id_col < post_id)))
+
+    return query.order_by(updated_col.desc(), id_col.desc()).limit(page_size + 1)
+
+
+def keyset_page(query, updated_col, id_col, codec, page_size, cursor=None, direction=OLDER) -> FeedPage:
+    """
+    Fetch one page of `query` ordered newest first on (updated, id).
+
+    Only `page_size + 1` rows are ever read, so the cost of a page does not
+    depend on how many rows sit before or after it.
+    """
+
+    position = codec.decode(cursor) if cursor else None
+    rows = keyset_query(query, updated_col, id_col, page_size, position, direction).all()
+    has_more = len(rows) > page_size
+
+    if position and direction == NEWER:
+        rows = list(reversed(rows[:page_size]))
+        has_newer = has_more
+        has_older = True
+
+    else:
+        rows = rows[:page_size]
+        has_older = has_more
+        has_newer = position is not None
+
+    page = FeedPage(rows)
+
+    if rows:
+        first, last = rows[0], rows[-1]
+        if has_newer:
+            page.newer = codec.encode(first.updated, first.id)
+        if has_older:
+            page.older = codec.encode(last.updated, last.id)
+
+    return page
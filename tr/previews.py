@@ -0,0 +1,32 @@
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+
+class PreviewCodec(object):
+    """
+    Carries the metadata a Preview resolved over to Send as a signed,
+    timestamped token in the form, so sending a post makes no second
+    lookup. A token only vouches for the share link it was issued for.
+    """
+
+    def __init__(self, secret_key, salt='preview', max_age=3600):
+        self.serializer = URLSafeTimedSerializer(secret_key, salt=salt)
+        self.max_age = max_age
+
+    def encode(self, post) -> str:
+        return self.serializer.dumps([post.share_link, post.title, post.album_art])
+
+    def decode(self, token, share_link):
+        """ The (title, album_art) previewed for `share_link`, or None if the token can't be used """
+
+        if not token:
+            return None
+
+        try:
+            previewed_link, title, album_art = self.serializer.loads(token, max_age=self.max_age)
+        except (BadSignature, ValueError, TypeError):
+            return None
+
+        if previewed_link != share_link or not (title or album_art):
+            return None
+
+        return title, album_art
@@ -0,0 +1,123 @@
+import re
+
+import requests
+
+from tr import http_client, og
+
+
+class ResolveError(Exception):
+    pass
+
+
+def https(link):
+    if link and link[0:5] == 'http:':
+        return 'https:' + link[5:]
+    return link
+
+
+def resolve_og(url) -> dict:
+    r = og.fetch_head(url)
+
+    if r.status_code != 200:
+        raise ResolveError(f"HTTP {r.status_code} from {r.url}")
+
+    try:
+        title = r.og['title']
+        image = r.og['image']
+    except KeyError:
+        raise ResolveError(f"No og:title/og:image at {r.url}")
+
+    return {'share_link': r.url, 'title': title, 'album_art': https(image)}
+
+
+def resolve_oembed(endpoint, url) -> dict:
+    r = http_client.client.get(endpoint, params={'format': 'json', 'url': url})
+
+    if r.status_code != 200:
+        raise ResolveError(f"HTTP {r.status_code} from {endpoint}")
+
+    try:
+        data = r.json()
+        return {'share_link': url, 'title': data['title'], 'album_art': https(data['thumbnail_url'])}
+    except (ValueError, KeyError, TypeError):
+        raise ResolveError(f"Unusable oEmbed response for {url}")
+
+
+class Provider(object):
+    """
+    A music site we know how to resolve. `pattern` is matched against the
+    start of the share link; `link` maps a share link to the page we send
+    people to and `resolve` turns that page into title/album art.
+    """
+
+    name = None
+    pattern = None
+
+    def link(self, share_link) -> str:
+        return share_link
+
+    def resolve(self, link) -> dict:
+        return resolve_og(link)
+
+
+class SongLink(Provider):
+    name = 'songlink'
+    pattern = r'https://song\.link/'
+
+
+class Bandcamp(Provider):
+    name = 'bandcamp'
+    pattern = r'https://[^/]*bandcamp\.com/'
+
+
+class SoundCloud(Provider):
+    name = 'soundcloud'
+    pattern = r'https://soundcloud\.com/'
+    oembed = 'https://soundcloud.com/oembed'
+
+    def resolve(self, link) -> dict:
+        try:
+            return resolve_oembed(self.oembed, link)
+        except (ResolveError, requests.RequestException):
+            return resolve_og(link)
+
+
+class SongLinkFallback(Provider):
+    """ Anything we don't recognize goes through song.link """
+
+    name = 'other'
+
+    def link(self, share_link) -> str:
+        return f"https://song.link/{share_link}"
+
+
+class ProviderRegistry(object):
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.providers = []
+        self._regex = None
+
+    def register(self, provider_class):
+        self.providers.append(provider_class())
+        self._regex = None
+        return provider_class
+
+    @property
+    def regex(self):
+        if self._regex is None:
+            self._regex = re.compile('|'.join(f"(?P<p{i}>{p.pattern})" for i, p in enumerate(self.providers)))
+        return self._regex
+
+    def match(self, share_link) -> Provider:
+        m = self.regex.match(share_link or '')
+
+        if m:
+            return self.providers[int(m.lastgroup[1:])]
+
+        return self.fallback
+
+
+registry = ProviderRegistry(SongLinkFallback())
+registry.register(SongLink)
+registry.register(Bandcamp)
+registry.register(SoundCloud)
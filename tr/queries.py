@@ -0,0 +1,137 @@
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event, func, true
+from sqlalchemy.orm import joinedload
+
+from tr import providers
+from tr.models import POST_DUE_STATES, MastodonHost, OutboxMail, Post, Reblog, User, nl2br, reltime
+
+# one card in the community feed; everything the card template reads and nothing else
+FeedPost = namedtuple('FeedPost', ['id', 'updated', 'user_id', 'album_art', 'comment_html',
+                                   'song_link', 'post_link', 'relative_date', 'mastodon_user', 'profile_link'])
+
+
+def with_author(query):
+    """ Load each post's user and their Mastodon host in the same SELECT """
+    return query.options(joinedload(Post.user).joinedload(User.mastodon_host))
+
+
+def feed_posts(session):
+    """
+    The columns a feed card needs for every sent post, author included,
+    as plain rows: no Post or User objects are built or tracked by the
+    session. Pass the rows through `feed_items()` to get FeedPosts.
+    """
+
+    return session.query(Post.id, Post.updated, Post.created, Post.user_id, Post.comment, Post.comment_html,
+                         Post.album_art, Post.share_link, Post.song_url, Post.status_id, Post.status_url,
+                         User.mastodon_user, MastodonHost.hostname) \
+                  .join(User, Post.user_id == User.id) \
+                  .join(MastodonHost, User.mastodon_host_id == MastodonHost.id) \
+                  .filter(Post.posted == true())
+
+
+def feed_items(rows, compare_to=None) -> list:
+    """
+    FeedPosts for rows from `feed_posts()`. The display fields come from the
+    columns the worker fills in when it sends a post; posts sent before
+    those existed have them worked out here instead.
+    """
+
+    compare_to = compare_to or datetime.utcnow()
+    items = []
+
+    for row in rows:
+        profile_link = f"https://{row.hostname}/@{row.mastodon_user}"
+        post_link = row.status_url
+
+        if not post_link and row.status_id:
+            post_link = f"{profile_link}/{row.status_id}"
+
+        items.append(FeedPost(id=row.id,
+                              updated=row.updated,
+                              user_id=row.user_id,
+                              album_art=row.album_art,
+                              comment_html=row.comment_html or nl2br(row.comment),
+                              song_link=row.song_url or providers.registry.match(row.share_link).link(row.share_link),
+                              post_link=post_link,
+                              relative_date=reltime(row.created, compare_to),
+                              mastodon_user=row.mastodon_user,
+                              profile_link=profile_link))
+
+    return items
+
+
+def pending_posts(session, now=None):
+    return with_author(session.query(Post)).filter(Post.due(now))
+
+
+def queue_stats(session, reblog_max_attempts, mail_max_attempts) -> dict:
+    """
+    (depth, oldest created) for the posting queue and each outbox. Outbox
+    rows that have used up their attempts are never sent or deleted, so
+    they are left out rather than counted as backlog forever.
+    """
+
+    return {
+        'posts': session.query(func.count(Post.id), func.min(Post.created))
+                        .filter(Post.state.in_(POST_DUE_STATES)).one(),
+        'reblogs': session.query(func.count(Reblog.id), func.min(Reblog.created))
+                          .filter(Reblog.attempts < reblog_max_attempts).one(),
+        'mail': session.query(func.count(OutboxMail.id), func.min(OutboxMail.created))
+                       .filter(OutboxMail.attempts < mail_max_attempts).one(),
+    }
+
+
+def iter_batches(session, query, batch_size=100):
+    """
+    Yield the posts matched by `query` as lists of at most `batch_size`,
+    walking forward by id so each page is a fresh indexed SELECT rather than
+    an OFFSET. Once the caller moves on to the next page the session is
+    committed and emptied, so the identity map holds one page at a time no
+    matter how long the queue is.
+    """
+
+    last_id = 0
+
+    while True:
+        batch = query.filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+
+        if not batch:
+            return
+
+        last_id = batch[-1].id
+
+        yield batch
+
+        session.commit()
+        session.expunge_all()
+
+
+class QueryCounter(object):
+    """
+    Count the SQL statements an engine executes inside a `with` block.
+
+        with QueryCounter(engine) as counter:
+            ...
+        counter.count
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+        self.parameters = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
@@ -1,234 +1,670 @@
 import argparse
+import fcntl
 import importlib
 import logging
-import mimetypes
 import os
+import signal
 import sys
-import tempfile
+import threading
 import time
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse
 
-import psutil
 import requests
-from flask import render_template, Flask
-from flask_mail import Message, Mail
+from flask import Flask
+from flask_mail import Mail
 from jinja2 import Environment, FileSystemLoader
-from mastodon import Mastodon, MastodonAPIError, MastodonNetworkError
-from sqlalchemy import create_engine, exc, func
+from mastodon import MastodonAPIError, MastodonNetworkError, MastodonRatelimitError
 from sqlalchemy.orm import Session
-from tr.models import Post
+from tr import artwork, feed_cache, http_client, mail_outbox, mastodon_clients, metadata_cache, metrics
+from tr.artwork import ArtworkError
+from tr.db import HealthCheck, create_db_engine
+from tr.host_scheduler import HostBusy, HostScheduler
+from tr.models import POST_DEAD, POST_DUE_STATES, POST_UPLOADING, Post, Reblog
+from tr.leases import abandon_upload, claim_posts, release_post, release_posts, start_upload, worker_name
+from tr.queries import iter_batches, with_author
 
-config = os.environ.get('TR_CONFIG', 'DevelopmentConfig')
-c = getattr(importlib.import_module('config'), config)
+FORMAT = "%(asctime)-15s [%(filename)s:%(lineno)s : %(funcName)s()] %(message)s"
 
-if c.SENTRY_DSN:
-    from raven import Client
+logging.basicConfig(format=FORMAT)
 
-    client = Client(c.SENTRY_DSN)
+l = logging.getLogger('worker')
+l.setLevel(logging.INFO)
 
-app = Flask(__name__)
-start_time = time.time()
-app.config.from_object('config.' + config)
+STOP_FILE = Path('worker_stop')
 
-parser = argparse.ArgumentParser(description='Worker')
-parser.add_argument('--worker', dest='worker', type=int, required=False, default=1)
-args = parser.parse_args()
 
-# worker_stat = WorkerStat(worker=args.worker)
+class WorkerLock(object):
+    """
+    Single-instance guard for `--worker N`. The lock is an flock() on the
+    lock file, so the kernel drops it when the process dies and there is
+    no stale pid to clean up.
+    """
 
-FORMAT = "%(asctime)-15s [%(filename)s:%(lineno)s : %(funcName)s()] %(message)s"
+    def __init__(self, worker):
+        self.path = Path(f'worker_{worker}.lock')
+        self.fd = None
 
-logging.basicConfig(format=FORMAT)
+    def acquire(self) -> bool:
+        fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644)
 
-l = logging.getLogger('worker')
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        return True
+
+    def release(self) -> None:
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def pid(self):
+        try:
+            return int(self.path.read_text().strip())
+        except (OSError, ValueError):
+            return None
 
-if c.DEBUG:
-    l.setLevel(logging.DEBUG)
-else:
-    l.setLevel(logging.INFO)
 
-j2_env = Environment(loader=FileSystemLoader('templates'),
-                     trim_blocks=True)
+class Worker(object):
+    def __init__(self, config, worker=1, jobs=None):
+        self.c = c = getattr(importlib.import_module('config'), config)
 
+        if c.SENTRY_DSN:
+            from raven import Client
 
-def check_worker_stop():
-    if Path('worker_stop').exists():
-        l.info("Worker paused...exiting")
-        # session.add(worker_stat)
-        session.commit()
-        session.close()
-        exit(0)
+            self.sentry = Client(c.SENTRY_DSN)
+
+        if c.DEBUG:
+            l.setLevel(logging.DEBUG)
+        else:
+            l.setLevel(logging.INFO)
+
+        self.app = Flask(__name__)
+        self.app.config.from_object('config.' + config)
+        http_client.configure(self.app.config)
+        feed_cache.configure(self.app.config)
+        mastodon_clients.configure(self.app.config, ratelimit_method='throw')
+        artwork.configure(self.app.config)
+
+        self.j2_env = Environment(loader=FileSystemLoader('templates'),
+                                  trim_blocks=True)
+        self.mail = Mail(self.app)
+
+        self.engine = create_db_engine(self.app.config)
+        metrics.instrument_engine(self.engine)
+        self.health_check = HealthCheck(lambda: self.engine)
+        metadata_cache.configure(self.app.config, self.engine)
+
+        self.owner = worker_name(worker)
+        self.jobs = jobs or c.WORKER_JOBS
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+
+        self.scheduler = HostScheduler(base_delay=c.HOST_BACKOFF_MIN, max_delay=c.HOST_BACKOFF_MAX,
+                                       window=c.HOST_RATELIMIT_WINDOW, reserve=c.HOST_RATELIMIT_RESERVE)
+        self.host_slots = {}
+        self.stats_lock = threading.Lock()
+        self.counts = {'sent': 0, 'skipped': 0, 'reblogged': 0, 'mailed': 0}
+
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.reblog_wakeup = threading.Event()
+        self.mail_wakeup = threading.Event()
+
+    def stop(self, *args) -> None:
+        l.info("Stopping after in-flight posts…")
+        self.stopping.set()
+        self.wakeup.set()
+        self.reblog_wakeup.set()
+        self.mail_wakeup.set()
+
+    def wake(self, *args) -> None:
+        self.wakeup.set()
+
+    def stop_requested(self) -> bool:
+        return self.stopping.is_set() or STOP_FILE.exists()
+
+    def process_post(self, session, post) -> bool:
+        """
+        Upload the album art, toot, reblog and mail for one post. Returns True
+        once the post has been sent.
+        """
+
+        c = self.c
+        user = post.user
+        mastodonhost = user.mastodon_host
+
+        if post.metadata_queued:
+            post.enrich_metadata()
+            session.commit()
+
+        if c.SEND and not start_upload(session, self.owner, post, c.WORKER_LEASE_TIME):
+            l.warning(f"Post {post.id} was claimed by another worker, leaving it to them")
+            return False
+
+        media_ids = []
+
+        mast_api = mastodon_clients.clients.get(f"https://{mastodonhost.hostname}",
+                                                mastodonhost.client_id,
+                                                mastodonhost.client_secret,
+                                                user.mastodon_access_code,
+                                                owner=user.id)
+
+        l.info(f"{user.mastodon_user}")
 
+        if c.SEND and post.album_art:
+            l.info(f"Fetching {post.album_art}")
 
-# logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+            try:
+                with metrics.stage('artwork', mastodonhost.hostname):
+                    upload_file_name = artwork.store.upload_file(post.album_art)
+            except (requests.RequestException, ArtworkError, OSError) as e:
+                l.error(e)
+                self.post_failed(session, post, e)
+                return False
 
-l.info("Starting up…")
-engine = create_engine(c.SQLALCHEMY_DATABASE_URI)
-engine.connect()
+            l.debug(f'Uploading {upload_file_name}')
 
-try:
-    engine.execute('SELECT 1 from users')
-except exc.SQLAlchemyError as e:
-    l.error(e)
-    sys.exit()
+            try:
+                media_ids.append(self.call_host(session, mastodonhost, user.id, mast_api.media_post,
+                                                str(upload_file_name)))
+            except (MastodonAPIError, MastodonNetworkError, MastodonRatelimitError, HostBusy, OSError) as e:
+                l.error(e)
+                self.post_failed(session, post, e)
+                return False
 
-session = Session(engine)
+        message_to_post = f"{post.comment}\n\n{post.share_link}"
 
-check_worker_stop()
+        vis = 'public'
+        if post.toot_visibility:
+            vis = post.toot_visibility
 
-lockfile = Path(f'worker_{args.worker}.lock')
+        l.info(message_to_post)
+
+        if not c.SEND:
+            return False
+
+        # kept aside in case the database goes away and the post can't be reloaded
+        post_id = post.id
 
-if Path(lockfile).exists():
-    l.info("Worker lock found")
-    with lockfile.open() as f:
-        pid = f.readline()
         try:
-            pid = int(pid)
-        except ValueError:
-            l.info("Corrupt lock file found")
-            lockfile.unlink()
+            new_message = self.call_host(session, mastodonhost, user.id, mast_api.status_post,
+                                         message_to_post,
+                                         visibility=vis,
+                                         media_ids=media_ids)
 
-        else:
-            if pid in psutil.pids():
-                l.info("Worker process still running...exiting")
+        except (MastodonAPIError, MastodonNetworkError, MastodonRatelimitError, HostBusy) as e:
+            l.error(e)
+            self.post_failed(session, post, e)
+            return False
+
+        try:
+            post.mark_posted(new_message["id"])
+
+            if c.ACCOUNT_ACCESS_TOKEN:
+                session.add(Reblog(post=post, status_id=new_message["id"]))
+
+            if c.MAIL_SERVER:
+                template = self.j2_env.get_template('email/new_post.txt.j2')
+                body = template.render(user=user, post=post)
+                l.debug(body)
+                mail_outbox.enqueue(session, mail_outbox.NEW_POST, "New Post", body, c.MAIL_TO)
+
+            session.commit()
+
+        except Exception as e:
+            # the toot is out, so record that on its own rather than retry and toot it again
+            l.exception(e)
+            session.rollback()
+
+            try:
+                post.mark_posted(new_message["id"])
                 session.commit()
-                session.close()
-                exit(0)
-            else:
-                l.info("Stale Worker found")
+            except Exception as e:
+                # most likely the database is down; whatever happens, don't let this post be sent again
+                l.exception(e)
+                l.error(f"Post {post_id} went out as status {new_message['id']} but couldn't be recorded, "
+                        f"leaving it uploading")
+                session.rollback()
 
-with lockfile.open('wt') as f:
-    f.write(str(psutil.Process().pid))
+                try:
+                    abandon_upload(session, self.owner, post_id)
+                except Exception as e:
+                    l.exception(e)
+                    session.rollback()
+
+                return False
+
+        feed_cache.cache.invalidate()
+        self.reblog_wakeup.set()
+        self.mail_wakeup.set()
 
-posts = session.query(Post).filter_by(posted=False)
-s = requests.Session()
+        return True
 
-# if not c.DEVELOPMENT:
-#     posts = posts.order_by(func.rand())
+    def post_failed(self, session, post, error) -> None:
+        """
+        Schedule the next attempt at a post. Being paced or rate limited by
+        its host doesn't count against the post; anything else uses up one of
+        POST_MAX_ATTEMPTS, after which the post is marked dead.
+        """
 
-for post in posts:
+        if isinstance(error, HostBusy):
+            post.retry_in(error.retry_in, error)
+        elif isinstance(error, MastodonRatelimitError):
+            post.retry_in(self.host_retry_in(post.user.mastodon_host, post.user_id), error)
+        else:
+            post.attempt_failed(error, self.c.POST_MAX_ATTEMPTS, self.c.POST_RETRY_TIME)
+
+            if post.state == POST_DEAD:
+                l.error(f"Giving up on post {post.id} after {post.attempts} attempts: {error}")
 
-    user = post.user
-    mastodonhost = user.mastodon_host
+        session.commit()
 
-    if mastodonhost.defer_until and mastodonhost.defer_until > datetime.now():
-        l.warning(f"Deferring connections to {mastodonhost.hostname}")
-        continue
+    def post_crashed(self, session, post, error) -> None:
+        """
+        Record an unexpected error from process_post() as a failed attempt so
+        the post backs off and is eventually marked dead. If the database is
+        what failed, the post keeps its lease and is picked up once it expires.
+        """
 
-    media_ids = []
+        try:
+            if post.state != POST_UPLOADING:
+                # start_upload() hadn't counted this attempt yet
+                post.attempts = (post.attempts or 0) + 1
 
-    mast_api = Mastodon(
-            client_id=mastodonhost.client_id,
-            client_secret=mastodonhost.client_secret,
-            api_base_url=f"https://{mastodonhost.hostname}",
-            access_token=user.mastodon_access_code,
-            debug_requests=False,
-            request_timeout=10
-    )
+            self.post_failed(session, post, error)
+        except Exception as e:
+            l.exception(e)
+            session.rollback()
 
-    l.info(f"{user.mastodon_user}")
+    def call_host(self, session, mastodonhost, account, method, *args, **kwargs):
+        """
+        Call a Mastodon API method as `account` (a user id) once the scheduler
+        allows it. Short waits are slept off; a longer one raises HostBusy so
+        the post is left for a later pass. A 429 only holds off that account,
+        since the limit is per token; failures back the host off for every
+        worker.
+        """
 
-    if c.SEND and post.album_art:
-        l.info(f"Downloading {post.album_art}")
-        attachment_file = requests.get(post.album_art, stream=True)
-        attachment_file.raw.decode_content = True
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        temp_file.write(attachment_file.raw.read())
-        temp_file.close()
+        hostname = mastodonhost.hostname
+        wait = self.scheduler.acquire(hostname, account)
 
-        path = urlparse(post.album_art).path
-        file_extension = mimetypes.guess_extension(attachment_file.headers['Content-type'])
+        while wait:
+            if wait > self.c.HOST_MAX_WAIT or self.stop_requested():
+                raise HostBusy(hostname, wait)
 
-        # ffs
-        if file_extension == '.jpe':
-            file_extension = '.jpg'
+            l.debug(f"Pacing {hostname} for {wait:.1f}s")
+            time.sleep(wait)
+            wait = self.scheduler.acquire(hostname, account)
 
-        upload_file_name = temp_file.name + file_extension
-        os.rename(temp_file.name, upload_file_name)
-        l.debug(f'Uploading {upload_file_name}')
+        api = method.__self__
 
         try:
-            media_ids.append(mast_api.media_post(upload_file_name))
-        except MastodonAPIError as e:
-            l.error(e)
-            continue
+            with metrics.stage(method.__name__, hostname):
+                result = method(*args, **kwargs)
+
+        except MastodonRatelimitError:
+            l.warning(f"Rate limited on {hostname} for {self.scheduler.rate_limited(hostname, api, account):.0f}s")
+            raise
 
         except MastodonNetworkError as e:
-            l.error(e)
-            mastodonhost.defer()
-            session.commit()
-            continue
+            self.defer_host(session, mastodonhost, self.scheduler.failure(hostname, e))
+            raise
+
+        except MastodonAPIError as e:
+            if len(e.args) > 1 and isinstance(e.args[1], int) and e.args[1] >= 500:
+                self.defer_host(session, mastodonhost, self.scheduler.failure(hostname, e))
+            raise
+
+        self.scheduler.success(hostname, api, account)
 
-    message_to_post = f"{post.comment}\n\n{post.share_link}"
+        return result
 
-    vis = 'public'
-    if post.toot_visibility:
-        vis = post.toot_visibility
+    def defer_host(self, session, mastodonhost, seconds) -> None:
+        l.warning(f"Backing off {mastodonhost.hostname} for {seconds:.0f}s")
+        mastodonhost.defer(seconds)
+        session.commit()
+
+    def host_retry_in(self, mastodonhost, account=None) -> float:
+        return self.scheduler.retry_in(mastodonhost.hostname, mastodonhost.defer_until, account)
+
+    def host_slot(self, host_id):
+        with self.stats_lock:
+            if host_id not in self.host_slots:
+                self.host_slots[host_id] = threading.BoundedSemaphore(self.c.WORKER_HOST_CONCURRENCY)
+            return self.host_slots[host_id]
+
+    def run_posts(self, post_ids) -> None:
+        """
+        Send one user's posts, oldest first, loading WORKER_QUEUE_BATCH at a
+        time. Each job gets its own session; at most WORKER_HOST_CONCURRENCY
+        jobs talk to the same instance at a time.
+        """
 
-    l.info(message_to_post)
+        session = Session(self.engine, expire_on_commit=False)
+        query = with_author(session.query(Post)).filter(Post.id.in_(post_ids), Post.claimed_by == self.owner)
 
-    if c.SEND:
         try:
-            new_message = mast_api.status_post(
-                    message_to_post,
-                    visibility=vis,
-                    media_ids=media_ids)
+            for batch in iter_batches(session, query, self.c.WORKER_QUEUE_BATCH):
+                for post in batch:
+                    if self.stop_requested():
+                        # hand the rest back now; a restarted worker has a new name and can't reclaim them
+                        session.rollback()
+                        release_posts(session, self.owner, post_ids)
+                        return
+
+                    if post.state not in POST_DUE_STATES:
+                        continue
+
+                    mastodonhost = post.user.mastodon_host
+                    retry_in = self.host_retry_in(mastodonhost, post.user_id)
+
+                    if retry_in:
+                        l.warning(f"Deferring post {post.id} on {mastodonhost.hostname} for {retry_in:.0f}s")
+                        post.retry_in(retry_in)
+                        release_post(session, self.owner, post)
+                        continue
+
+                    with self.host_slot(mastodonhost.id):
+                        try:
+                            sent = self.process_post(session, post)
+                        except Exception as e:
+                            l.exception(e)
+                            session.rollback()
+                            sent = False
+                            self.post_crashed(session, post, e)
+
+                    release_post(session, self.owner, post)
+
+                    with self.stats_lock:
+                        self.counts['sent' if sent else 'skipped'] += 1
+
+                    metrics.WORKER_ITEMS.inc(kind='post', outcome='sent' if sent else 'skipped')
+        finally:
+            session.close()
+
+    def drain(self) -> int:
+        """ Claim and send batches until the queue is empty. Returns the number of posts sent. """
+
+        c = self.c
+        session = Session(self.engine, expire_on_commit=False)
+        last_id = 0
+        sent = self.counts['sent']
 
-        except MastodonAPIError as e:
-            l.error(e)
-            continue
+        try:
+            while not self.stop_requested():
+                claimed = claim_posts(session, self.owner, c.WORKER_CLAIM_BATCH, c.WORKER_LEASE_TIME,
+                                      after_id=last_id)
 
-        except MastodonNetworkError as e:
-            l.error(e)
-            mastodonhost.defer()
-            session.commit()
-            continue
+                if not claimed:
+                    break
 
-        else:
-            post.updated = datetime.now()
-            post.status_id = new_message["id"]
-            post.posted = True
-            session.commit()
+                last_id = claimed[-1]
+                posts_by_user = OrderedDict()
 
-            if c.ACCOUNT_ACCESS_TOKEN:
+                for post_id, user_id in session.query(Post.id, Post.user_id) \
+                                               .filter(Post.id.in_(claimed)).order_by(Post.id):
+                    posts_by_user.setdefault(user_id, []).append(post_id)
 
-                for tries in range(0, 10):
-                    tusk_poster_api = Mastodon(
-                            client_id=c.ACCOUNT_CLIENT_ID,
-                            client_secret=c.ACCOUNT_CLIENT_SECRET,
-                            api_base_url=c.ACCOUNT_BASE_URL,
-                            access_token=c.ACCOUNT_ACCESS_TOKEN,
-                            debug_requests=False,
-                            request_timeout=10
-                    )
-
-                    try:
-                        tusk_poster_api.status_reblog(new_message)
-                        break
-                    except MastodonAPIError as e:
-                        time.sleep(6)
-                        l.error(e)
-
-        if c.MAIL_SERVER:
-            with app.app_context() as ctx:
-                mail = Mail(app)
-                template = j2_env.get_template('email/new_post.txt.j2')
-                body = template.render(user=user, post=post)
-                l.debug(body)
-                msg = Message(subject=f"New Post",
-                              body=body,
-                              recipients=[c.MAIL_TO])
+                l.info(f"{self.owner} claimed {len(claimed)} posts from {len(posts_by_user)} users, "
+                       f"{self.jobs} jobs")
+
+                for future in [self.executor.submit(self.run_posts, ids) for ids in posts_by_user.values()]:
+                    future.result()
+        finally:
+            session.close()
+
+        return self.counts['sent'] - sent
+
+    def send_reblogs(self) -> int:
+        """
+        Boost up to REBLOG_BATCH sent posts from the curator account. Stops at
+        the first sign of trouble with the curator's instance and leaves the
+        rest for a later pass. Returns the number boosted.
+        """
+
+        c = self.c
+
+        if not c.ACCOUNT_ACCESS_TOKEN:
+            return 0
+
+        hostname = urlparse(c.ACCOUNT_BASE_URL).netloc
+
+        if self.scheduler.retry_in(hostname):
+            return 0
+
+        api = mastodon_clients.clients.get(c.ACCOUNT_BASE_URL,
+                                           c.ACCOUNT_CLIENT_ID,
+                                           c.ACCOUNT_CLIENT_SECRET,
+                                           c.ACCOUNT_ACCESS_TOKEN)
+        session = Session(self.engine, expire_on_commit=False)
+        sent = 0
+
+        try:
+            reblogs = session.query(Reblog).filter(Reblog.due(c.REBLOG_MAX_ATTEMPTS)) \
+                                           .order_by(Reblog.id).limit(c.REBLOG_BATCH).all()
+
+            for reblog in reblogs:
+                if self.scheduler.acquire(hostname) or self.stop_requested():
+                    break
 
                 try:
-                    mail.send(msg)
+                    with metrics.stage('reblog', hostname):
+                        api.status_reblog(reblog.status_id)
+
+                except MastodonRatelimitError as e:
+                    l.warning(f"Curator rate limited for {self.scheduler.rate_limited(hostname, api):.0f}s: {e}")
+                    break
+
+                except MastodonNetworkError as e:
+                    l.warning(f"Curator unreachable for {self.scheduler.failure(hostname, e):.0f}s: {e}")
+                    break
+
+                except MastodonAPIError as e:
+                    l.error(f"Reblog of post {reblog.post_id} failed: {e}")
+                    reblog.failed(e, c.REBLOG_RETRY_TIME)
+
+                    if len(e.args) > 1 and isinstance(e.args[1], int) and e.args[1] >= 500:
+                        self.scheduler.failure(hostname, e)
+                        break
+
+                    continue
+
+                self.scheduler.success(hostname, api)
+                session.delete(reblog)
+                sent += 1
+
+            session.commit()
+        finally:
+            session.close()
+
+        with self.stats_lock:
+            self.counts['reblogged'] += sent
+
+        metrics.WORKER_ITEMS.inc(sent, kind='reblog', outcome='sent')
+
+        return sent
+
+    def send_mail(self) -> int:
+        """ Send queued notification mail over one SMTP connection. Returns the number sent. """
+
+        if not self.c.MAIL_SERVER:
+            return 0
+
+        session = Session(self.engine, expire_on_commit=False)
+
+        try:
+            with self.app.app_context(), metrics.stage('mail', self.c.MAIL_SERVER):
+                sent = mail_outbox.send_pending(session, self.mail, self.app.config)
+        finally:
+            session.close()
+
+        with self.stats_lock:
+            self.counts['mailed'] += sent
+
+        metrics.WORKER_ITEMS.inc(sent, kind='mail', outcome='sent')
+
+        return sent
+
+    def run_outbox(self, send, wakeup) -> None:
+        """ Loop for --daemon that drains one outbox beside the posting loop """
+
+        c = self.c
+        interval = c.WORKER_POLL_MIN
 
+        while not self.stop_requested():
+            try:
+                sent = send()
+            except Exception as e:
+                l.exception(e)
+                sent = 0
+
+            if sent:
+                interval = c.WORKER_POLL_MIN
+            else:
+                interval = min(interval * 2, c.WORKER_POLL_MAX)
+
+            wakeup.wait(interval)
+            wakeup.clear()
+
+    def report(self, elapsed) -> None:
+        sent = self.counts['sent']
+        l.info(f"Sent {sent} posts, skipped {self.counts['skipped']} in {elapsed:.1f}s "
+               f"({sent / elapsed if elapsed else 0:.2f} posts/s), reblogged {self.counts['reblogged']}, "
+               f"mailed {self.counts['mailed']}")
+        l.info(f"HTTP: {http_client.client.stats()}")
+        l.info(f"Mastodon clients: {mastodon_clients.clients.stats()}")
+
+        for hostname, state in sorted(self.scheduler.states().items()):
+            l.info(f"Host {hostname}: {state}")
+        l.info(f"Metadata cache: {metadata_cache.cache.stats()}")
+        l.info(f"Artwork: {artwork.store.stats()}")
+        self.write_metrics()
+
+    def write_metrics(self) -> None:
+        """ Publish this process's metrics for node_exporter's textfile collector, if METRICS_TEXTFILE is set """
+
+        if not self.c.METRICS_TEXTFILE:
+            return
+
+        try:
+            metrics.REGISTRY.write_textfile(self.c.METRICS_TEXTFILE)
+        except OSError as e:
+            l.error(f"Writing metrics: {e}")
+
+    def run_once(self) -> None:
+        start = time.time()
+        self.drain()
+        self.send_reblogs()
+        self.send_mail()
+        self.report(time.time() - start)
+
+    def run_forever(self) -> None:
+        """
+        Keep the engine, HTTP pool and thread pool warm and poll for work,
+        backing off from WORKER_POLL_MIN to WORKER_POLL_MAX seconds while the
+        queue stays empty. SIGUSR1 wakes the loop early. Reblogs are sent from
+        their own thread, and so is mail, so neither the curator's instance nor
+        the SMTP server can slow posting down.
+        """
+
+        c = self.c
+        interval = c.WORKER_POLL_MIN
+        start = time.time()
+
+        outboxes = [threading.Thread(target=self.run_outbox, args=(self.send_reblogs, self.reblog_wakeup),
+                                     name='reblogs', daemon=True),
+                    threading.Thread(target=self.run_outbox, args=(self.send_mail, self.mail_wakeup),
+                                     name='mail', daemon=True)]
+
+        for thread in outboxes:
+            thread.start()
+
+        while not self.stop_requested():
+            if not self.health_check.check():
+                l.error(self.health_check.error)
+                sent = 0
+            else:
+                try:
+                    sent = self.drain()
                 except Exception as e:
-                    l.error(e)
+                    l.exception(e)
+                    self.health_check.check(force=True)
+                    sent = 0
+
+            self.write_metrics()
+
+            if sent:
+                interval = c.WORKER_POLL_MIN
+            else:
+                interval = min(interval * 2, c.WORKER_POLL_MAX)
+
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+        for thread in outboxes:
+            thread.join()
+
+        self.report(time.time() - start)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker')
+    parser.add_argument('--worker', dest='worker', type=int, required=False, default=1)
+    parser.add_argument('--jobs', dest='jobs', type=int, required=False, default=None,
+                        help='number of users to post for in parallel (default: WORKER_JOBS)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and poll for new posts instead of exiting when the queue is empty')
+    args = parser.parse_args()
+
+    # logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+
+    if STOP_FILE.exists():
+        l.info("Worker paused...exiting")
+        return
+
+    lock = WorkerLock(args.worker)
+
+    if not lock.acquire():
+        l.info(f"Worker process {lock.pid()} still running...exiting")
+        return
+
+    l.info("Starting up…")
+
+    worker = Worker(os.environ.get('TR_CONFIG', 'DevelopmentConfig'), args.worker, args.jobs)
+
+    try:
+        if not worker.health_check.check():
+            l.error(worker.health_check.error)
+            sys.exit(1)
+
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        signal.signal(signal.SIGUSR1, worker.wake)
+
+        if args.daemon:
+            worker.run_forever()
+        else:
+            worker.run_once()
+
+    finally:
+        worker.close()
+        lock.release()
 
-    check_worker_stop()
+    l.info("-- All done")
 
-l.info(f"-- All done")
 
-lockfile.unlink()
+if __name__ == '__main__':
+    main()